@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import importlib
+import json
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from pandas import DataFrame
+from pymatgen import Structure
+
+from neighbormodels.cache import hash_mapping
+from neighbormodels.interactions import MagneticPatterns, build_model
+from neighbormodels.neighbors import NeighborData, count_neighbors
+from neighbormodels.structure import from_file, label_subspecies
+
+CHECKPOINT_FILE = "checkpoint.txt"
+COEFFICIENTS_DIRECTORY = "coefficients"
+FILE_FORMATS = ("parquet", "csv")
+PARQUET_ENGINES = ("pyarrow", "fastparquet")
+
+
+class BatchJob(NamedTuple):
+    name: str
+    structure_file: str
+    r: float
+    magnetic_patterns: MagneticPatterns
+    subspecies: List[int] = []
+    distance_filter: Optional[Dict[str, List[float]]] = None
+
+
+def read_manifest(manifest_file: str) -> List[BatchJob]:
+    """Reads a JSON manifest of batch jobs.
+
+    The manifest is either a list of job objects or an object with a ``jobs`` list.
+    Each job object has the keys ``name``, ``structure``, ``r``, and ``patterns``,
+    and optionally ``subspecies`` and ``distance_filter``. Relative structure paths
+    are resolved against the directory containing the manifest.
+
+    :param manifest_file: Path to the JSON manifest file.
+    :return: A list of ``BatchJob`` tuples in manifest order.
+    """
+    with open(manifest_file, "rt", encoding="utf8") as f:
+        manifest: Any = json.load(f)
+
+    if isinstance(manifest, dict):
+        manifest = manifest["jobs"]
+
+    manifest_directory: str = os.path.dirname(os.path.abspath(manifest_file))
+
+    jobs: List[BatchJob] = [
+        BatchJob(
+            name=str(job["name"]),
+            structure_file=os.path.join(manifest_directory, job["structure"]),
+            r=float(job["r"]),
+            magnetic_patterns=job["patterns"],
+            subspecies=job.get("subspecies", []),
+            distance_filter=job.get("distance_filter"),
+        )
+        for job in manifest
+    ]
+
+    check_job_names(jobs=jobs)
+
+    return jobs
+
+
+def check_job_names(jobs: List[BatchJob]) -> None:
+    """Checks that the job names are unique and can be used as file names.
+
+    :param jobs: A list of ``BatchJob`` tuples.
+    """
+    seen_names: Set[str] = set()
+
+    for job in jobs:
+        if not job.name or os.sep in job.name or job.name in (".", ".."):
+            raise ValueError(f"Job name {job.name!r} cannot be used as a file name.")
+
+        if job.name in seen_names:
+            raise ValueError(f"Job name {job.name!r} appears more than once.")
+
+        seen_names.add(job.name)
+
+
+def hash_job(job: BatchJob) -> str:
+    """Computes a stable content hash of a job's parameters and of the contents of
+    its structure file, so that a checkpoint entry is only reused while neither the
+    job nor its structure file changed.
+
+    :param job: A ``BatchJob`` tuple.
+    :return: A hexadecimal digest.
+    """
+    structure_file_hash: Optional[str] = (
+        hash_file(file_path=job.structure_file)
+        if os.path.isfile(job.structure_file)
+        else None
+    )
+
+    return hash_mapping(
+        mapping={**job._asdict(), "structure_file_hash": structure_file_hash}
+    )
+
+
+def hash_file(file_path: str, block_size: int = 2 ** 20) -> str:
+    """Computes a content hash of a file, reading it in blocks.
+
+    :param file_path: Path to the file.
+    :param block_size: The number of bytes read at once (default 1 MiB).
+    :return: A hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def check_parquet_engine() -> None:
+    """Checks that a parquet engine for pandas is installed.
+
+    :raises ImportError: If neither ``pyarrow`` nor ``fastparquet`` can be imported.
+    """
+    for engine in PARQUET_ENGINES:
+        try:
+            importlib.import_module(engine)
+
+            return
+
+        except ImportError:
+            continue
+
+    raise ImportError(
+        "Parquet output requires pyarrow (pip install neighbormodels[parquet]); "
+        "use the csv file format instead."
+    )
+
+
+def run_job(job: BatchJob) -> DataFrame:
+    """Counts the neighbors and builds the interaction model for a single job.
+
+    :param job: A ``BatchJob`` tuple.
+    :return: A pandas ``DataFrame`` of the model coefficients with a ``job`` column
+        holding the job name.
+    """
+    cell_structure: Structure = from_file(structure_file=job.structure_file)
+
+    if job.subspecies:
+        label_subspecies(cell_structure=cell_structure, site_indices=job.subspecies)
+
+    neighbor_data: NeighborData = count_neighbors(
+        cell_structure=cell_structure, r=job.r
+    )
+
+    model_df: DataFrame = build_model(
+        neighbor_data=neighbor_data,
+        magnetic_patterns=job.magnetic_patterns,
+        distance_filter=job.distance_filter,
+    )
+    model_df.insert(loc=0, column="job", value=job.name)
+
+    return model_df
+
+
+def read_checkpoint(output_directory: str) -> Set[str]:
+    """Reads the jobs that completed in earlier runs.
+
+    :param output_directory: The batch output directory.
+    :return: A set of checkpoint entries, each holding a completed job's name and
+        the hash of its parameters separated by a tab.
+    """
+    checkpoint_path: str = os.path.join(output_directory, CHECKPOINT_FILE)
+
+    if not os.path.exists(checkpoint_path):
+        return set()
+
+    with open(checkpoint_path, "rt", encoding="utf8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def write_job_output(
+    model_df: DataFrame,
+    job_name: str,
+    job_hash: str,
+    output_directory: str,
+    file_format: str,
+) -> str:
+    """Writes the coefficient table of a job and then records the job in the
+    checkpoint file. The table is written to a temporary file and renamed into
+    place, so an interrupted write never leaves a partial table behind.
+
+    :param model_df: A pandas ``DataFrame`` of the model coefficients.
+    :param job_name: The name of the job.
+    :param job_hash: The hash of the job's parameters, as returned by
+        ``hash_job()``.
+    :param output_directory: The batch output directory.
+    :param file_format: The output file format, either ``parquet`` or ``csv``.
+    :return: Path to the coefficient table.
+    """
+    output_path: str = os.path.join(
+        output_directory, COEFFICIENTS_DIRECTORY, f"{job_name}.{file_format}"
+    )
+    temporary_path: str = f"{output_path}.tmp"
+
+    if file_format == "parquet":
+        model_df.to_parquet(temporary_path, index=False)
+
+    else:
+        model_df.to_csv(temporary_path, index=False)
+
+    os.replace(temporary_path, output_path)
+
+    with open(
+        os.path.join(output_directory, CHECKPOINT_FILE), "at", encoding="utf8"
+    ) as f:
+        f.write(f"{job_name}\t{job_hash}\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    return output_path
+
+
+def run_batch(
+    jobs: List[BatchJob],
+    output_directory: str,
+    max_workers: Optional[int] = None,
+    file_format: str = "parquet",
+) -> List[str]:
+    """Runs batch jobs on a local process pool, skipping the jobs recorded in the
+    checkpoint file of ``output_directory``. A job is only skipped if its parameters
+    are unchanged since it was recorded. Each coefficient table is written as soon
+    as its job finishes.
+
+    :param jobs: A list of ``BatchJob`` tuples.
+    :param output_directory: The batch output directory. It is created if missing.
+    :param max_workers: The number of worker processes (default: the number of
+        processors on the machine).
+    :param file_format: The output file format, either ``parquet`` or ``csv``
+        (default ``parquet``).
+    :return: A list of the names of the jobs that failed.
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"file_format must be one of {FILE_FORMATS}.")
+
+    check_job_names(jobs=jobs)
+
+    if file_format == "parquet":
+        check_parquet_engine()
+
+    os.makedirs(os.path.join(output_directory, COEFFICIENTS_DIRECTORY), exist_ok=True)
+
+    completed_jobs: Set[str] = read_checkpoint(output_directory=output_directory)
+    job_hashes: Dict[str, str] = {job.name: hash_job(job=job) for job in jobs}
+    pending_jobs: List[BatchJob] = [
+        job
+        for job in jobs
+        if f"{job.name}\t{job_hashes[job.name]}" not in completed_jobs
+    ]
+    failed_jobs: List[str] = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures: Dict[Future, BatchJob] = {
+            executor.submit(run_job, job): job for job in pending_jobs
+        }
+
+        for future in as_completed(futures):
+            job: BatchJob = futures.pop(future)
+
+            try:
+                write_job_output(
+                    model_df=future.result(),
+                    job_name=job.name,
+                    job_hash=job_hashes[job.name],
+                    output_directory=output_directory,
+                    file_format=file_format,
+                )
+
+            except Exception as error:
+                print(f"Job {job.name!r} failed: {error!r}", file=sys.stderr)
+                failed_jobs.append(job.name)
+
+    return failed_jobs
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pymatgen import Structure
+
+from neighbormodels.interactions import MagneticPatterns, build_model
+from neighbormodels.neighbors import NeighborData, count_neighbors
+from neighbormodels.structure import StructureSnapshot, to_snapshot
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    nbytes: int
+
+
+class ResultCache:
+    """A thread-safe least-recently-used cache bounded by the number of entries and
+    the approximate size of the cached values in bytes.
+
+    :param max_entries: The maximum number of cached values (default 128).
+    :param max_bytes: The maximum approximate size of the cached values in bytes
+        (default 512 MiB). Values larger than this are never cached.
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 512 * 2 ** 20):
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        self._nbytes: int = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Looks up a cached value and marks it as recently used.
+
+        :param key: The cache key.
+        :return: The cached value, or ``None`` if ``key`` is not in the cache.
+        """
+        with self._lock:
+            entry: Optional[Tuple[Any, int]] = self._entries.get(key)
+
+            if entry is None:
+                self._misses += 1
+
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        """Adds a value to the cache, evicting the least recently used values until
+        both bounds are satisfied.
+
+        :param key: The cache key.
+        :param value: The value to cache.
+        :param nbytes: The approximate size of ``value`` in bytes.
+        """
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+
+            while (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                self._nbytes -= self._entries.popitem(last=False)[1][1]
+                self._evictions += 1
+
+    def info(self) -> CacheInfo:
+        """Reports the cache statistics.
+
+        :return: A ``CacheInfo`` tuple of the hit, miss, and eviction counts and the
+            current number and approximate size of the cached values.
+        """
+        with self._lock:
+            return CacheInfo(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                entries=len(self._entries),
+                nbytes=self._nbytes,
+            )
+
+    def clear(self) -> None:
+        """Removes all cached values and resets the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._nbytes = 0
+
+
+default_cache: ResultCache = ResultCache()
+
+
+def count_neighbors_cached(
+    cell_structure: Structure, r: float, cache: Optional[ResultCache] = None
+) -> NeighborData:
+    """Memoized version of ``count_neighbors()``. Results are keyed by the content of
+    the structure, so equal structures share a cache entry even if they are
+    different objects.
+
+    :param cell_structure: A pymatgen ``Structure`` object.
+    :param r: Radius of sphere.
+    :param cache: The ``ResultCache`` to use (default: ``default_cache``).
+    :return: A ``NeighborData`` tuple. Its data frames are copies, so modifying them
+        does not alter the cache.
+    """
+    cache = default_cache if cache is None else cache
+    key: Tuple[str, str, float] = (
+        "count_neighbors",
+        hash_snapshot(snapshot=to_snapshot(cell_structure=cell_structure)),
+        float(r),
+    )
+
+    neighbor_data: Optional[NeighborData] = cache.get(key)
+
+    if neighbor_data is None:
+        neighbor_data = count_neighbors(cell_structure=cell_structure, r=r)
+        cache.put(
+            key=key,
+            value=neighbor_data,
+            nbytes=estimate_neighbor_data_nbytes(neighbor_data=neighbor_data),
+        )
+
+    return copy_neighbor_data(neighbor_data=neighbor_data)
+
+
+def build_model_cached(
+    neighbor_data: NeighborData,
+    magnetic_patterns: MagneticPatterns,
+    distance_filter: Optional[Dict[str, List[float]]] = None,
+    cache: Optional[ResultCache] = None,
+) -> DataFrame:
+    """Memoized version of ``build_model()``. Results are keyed by the content of the
+    neighbor data, magnetic patterns, and distance filter.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
+        the crystal structure and used to compute the interaction coefficients of the
+        model.
+    :param distance_filter: A dictionary that defines pair distances to keep in the
+        model, as accepted by ``build_model()``.
+    :param cache: The ``ResultCache`` to use (default: ``default_cache``).
+    :return: A copy of the pandas ``DataFrame`` returned by ``build_model()``.
+    """
+    cache = default_cache if cache is None else cache
+    key: Tuple[str, str, str, str] = (
+        "build_model",
+        hash_neighbor_data(neighbor_data=neighbor_data),
+        hash_mapping(mapping=magnetic_patterns),
+        hash_mapping(mapping=distance_filter),
+    )
+
+    model_df: Optional[DataFrame] = cache.get(key)
+
+    if model_df is None:
+        model_df = build_model(
+            neighbor_data=neighbor_data,
+            magnetic_patterns=magnetic_patterns,
+            distance_filter=distance_filter,
+        )
+        cache.put(
+            key=key,
+            value=model_df,
+            nbytes=int(model_df.memory_usage(deep=True).sum()),
+        )
+
+    return model_df.copy()
+
+
+def hash_snapshot(snapshot: StructureSnapshot) -> str:
+    """Computes a stable content hash of a structure snapshot.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :return: A hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+
+    for array in (
+        snapshot.lattice,
+        snapshot.frac_coords,
+        snapshot.species,
+        snapshot.subspecies,
+    ):
+        digest.update(str(array.shape).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+    digest.update(
+        json.dumps([snapshot.species_names, snapshot.subspecies_names]).encode()
+    )
+
+    return digest.hexdigest()
+
+
+def hash_mapping(mapping: Optional[Dict[str, Any]]) -> str:
+    """Computes a stable content hash of a dictionary of magnetic patterns or of a
+    distance filter. Keys are sorted, so insertion order does not matter.
+
+    :param mapping: A dictionary whose values are numbers, lists of numbers, or
+        arrays, or ``None``.
+    :return: A hexadecimal digest.
+    """
+    serialized: str = json.dumps(
+        mapping, sort_keys=True, default=lambda x: np.asarray(x).tolist()
+    )
+
+    return hashlib.blake2b(serialized.encode(), digest_size=20).hexdigest()
+
+
+def hash_data_frame(data_frame: DataFrame) -> str:
+    """Computes a stable content hash of a data frame's columns and values.
+    Categorical columns are hashed through their codes and categories.
+
+    :param data_frame: A pandas ``DataFrame``.
+    :return: A hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+
+    for column_name, column in data_frame.items():
+        digest.update(f"{column_name}:{column.dtype}".encode())
+
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            digest.update(column.cat.codes.values.tobytes())
+            digest.update(
+                json.dumps(column.cat.categories.astype(str).tolist()).encode()
+            )
+
+        elif column.dtype == object:
+            digest.update(
+                pd.util.hash_pandas_object(column, index=False).values.tobytes()
+            )
+
+        else:
+            digest.update(np.ascontiguousarray(column.values).tobytes())
+
+    return digest.hexdigest()
+
+
+def hash_neighbor_data(neighbor_data: NeighborData) -> str:
+    """Computes a stable content hash of neighbor data.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :return: A hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(hash_data_frame(data_frame=neighbor_data.neighbor_count).encode())
+    digest.update(hash_data_frame(data_frame=neighbor_data.sublattice_pairs).encode())
+    digest.update(hash_snapshot(snapshot=neighbor_data.structure).encode())
+
+    return digest.hexdigest()
+
+
+def estimate_neighbor_data_nbytes(neighbor_data: NeighborData) -> int:
+    """Estimates the memory used by neighbor data.
+
+    :param neighbor_data: A ``NeighborData`` tuple.
+    :return: The approximate size in bytes.
+    """
+    frames_nbytes: int = sum(
+        int(data_frame.memory_usage(deep=True).sum())
+        for data_frame in (
+            neighbor_data.neighbor_count,
+            neighbor_data.sublattice_pairs,
+            neighbor_data.bonds,
+        )
+        if data_frame is not None
+    )
+    snapshot_nbytes: int = sum(
+        array.nbytes
+        for array in neighbor_data.structure
+        if isinstance(array, np.ndarray)
+    )
+
+    return frames_nbytes + snapshot_nbytes
+
+
+def copy_neighbor_data(neighbor_data: NeighborData) -> NeighborData:
+    """Copies the data frames of neighbor data. The structure snapshot is read-only,
+    so it is shared.
+
+    :param neighbor_data: A ``NeighborData`` tuple.
+    :return: A ``NeighborData`` tuple with copied data frames.
+    """
+    return neighbor_data._replace(
+        neighbor_count=neighbor_data.neighbor_count.copy(),
+        sublattice_pairs=neighbor_data.sublattice_pairs.copy(),
+        bonds=None if neighbor_data.bonds is None else neighbor_data.bonds.copy(),
+    )
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+from typing import List, Optional
+
+from neighbormodels.batch import FILE_FORMATS, BatchJob, read_manifest, run_batch
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for the ``neighbormodels`` command-line tool.
+
+    :param argv: A list of command-line arguments (default: ``sys.argv[1:]``).
+    :return: The exit status, which is 1 if any job failed and 0 otherwise.
+    """
+    parser: argparse.ArgumentParser = build_argument_parser()
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    jobs: List[BatchJob] = read_manifest(manifest_file=args.manifest)
+
+    try:
+        failed_jobs: List[str] = run_batch(
+            jobs=jobs,
+            output_directory=args.output,
+            max_workers=args.workers,
+            file_format=args.format,
+        )
+
+    except ImportError as error:
+        parser.error(str(error))
+
+    if failed_jobs:
+        print(f"{len(failed_jobs)} of {len(jobs)} jobs failed.", file=sys.stderr)
+
+        return 1
+
+    return 0
+
+
+def build_argument_parser() -> argparse.ArgumentParser:
+    """Builds the argument parser for the ``neighbormodels`` command-line tool.
+
+    :return: An ``ArgumentParser`` object.
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="neighbormodels",
+        description=(
+            "Count neighbors and build interaction models for a manifest of "
+            "structures. Completed jobs are recorded in the output directory, so "
+            "rerunning the same command resumes an interrupted run."
+        ),
+    )
+    parser.add_argument("manifest", help="path to the JSON manifest of jobs")
+    parser.add_argument(
+        "-o", "--output", required=True, help="directory for the output tables"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes (default: number of processors)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FILE_FORMATS,
+        default="parquet",
+        help="file format of the coefficient tables (default: parquet)",
+    )
+
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pymatgen import Structure
+
+from neighbormodels.interactions import MagneticPatterns
+from neighbormodels.neighbors import (
+    NeighborList,
+    add_subspecie_labels_if_missing,
+    build_neighbor_list,
+    find_unique_distances,
+)
+from neighbormodels.structure import (
+    StructureSnapshot,
+    SymmetryCosets,
+    get_symmetry_cosets,
+    to_snapshot,
+)
+
+CLUSTER_EDGES = {(0, 1): 0, (0, 2): 1, (1, 2): 2}
+
+
+class ClusterData(NamedTuple):
+    pair_sites: np.ndarray
+    pair_clusters: np.ndarray
+    pair_cluster_names: List[str]
+    triplet_sites: np.ndarray
+    triplet_clusters: np.ndarray
+    triplet_cluster_names: List[str]
+    structure: StructureSnapshot
+
+
+def count_clusters(
+    cell_structure: Structure,
+    r: float,
+    block_size: int = 1000000,
+    use_symmetry: bool = True,
+    symprec: float = 0.01,
+) -> ClusterData:
+    """Finds the neighbor pairs and the triangles of mutual neighbors in the crystal
+    structure and groups them into symmetry-distinct clusters. The clusters are
+    used to build biquadratic and three-site interaction models.
+
+    :param cell_structure: A pymatgen ``Structure`` object.
+    :param r: Radius of sphere. All edges of a cluster are no longer than ``r``.
+    :param block_size: The maximum number of candidate triplets handled at once
+        (default 1000000).
+    :param use_symmetry: Split clusters with the same edge lengths and subspecies
+        into orbits of the structure's space group operations. The translations of
+        a supercell are handled through reference sites, so the cost grows with
+        the number of clusters times the number of distinct rotations, not with
+        the number of operations. If False, clusters are grouped by their edge
+        lengths and subspecies alone, which merges clusters that are not related
+        by symmetry (default True).
+    :param symprec: Symmetry tolerance passed to ``get_symmetry_cosets()``
+        (default 0.01).
+    :return: A named tuple with seven field names:
+
+        ``pair_sites``
+            An array of the site indices ``(i, j)`` of each neighbor pair.
+
+        ``pair_clusters``
+            An array of the cluster index of each neighbor pair.
+
+        ``pair_cluster_names``
+            A list of the biquadratic parameter name of each pair cluster.
+
+        ``triplet_sites``
+            An array of the site indices ``(i, j, k)`` of each triangle, listed once
+            for every site of the triangle.
+
+        ``triplet_clusters``
+            An array of the cluster index of each triangle.
+
+        ``triplet_cluster_names``
+            A list of the three-site parameter name of each triangle cluster.
+
+        ``structure``
+            A compact ``StructureSnapshot`` of the crystal structure.
+    """
+    cell_structure = add_subspecie_labels_if_missing(cell_structure=cell_structure)
+    snapshot: StructureSnapshot = to_snapshot(cell_structure=cell_structure)
+
+    return find_clusters(
+        neighbor_list=build_neighbor_list(cell_structure=cell_structure, r=r),
+        snapshot=snapshot,
+        r=r,
+        block_size=block_size,
+        symmetry_cosets=(
+            get_symmetry_cosets(snapshot=snapshot, symprec=symprec)
+            if use_symmetry
+            else None
+        ),
+    )
+
+
+def find_clusters(
+    neighbor_list: NeighborList,
+    snapshot: StructureSnapshot,
+    r: float,
+    block_size: int = 1000000,
+    symmetry_cosets: Optional[SymmetryCosets] = None,
+) -> ClusterData:
+    """Groups the neighbor pairs and triangles found in a neighbor list into distinct
+    clusters. Clusters are first keyed by the subspecies of their sites and the
+    distance shells of their edges. If ``symmetry_cosets`` is given, each key is
+    then split into the orbits of the space group.
+
+    :param neighbor_list: A ``NeighborList`` tuple returned by
+        ``build_neighbor_list()``.
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere used to build ``neighbor_list``.
+    :param block_size: The maximum number of candidate triplets handled at once
+        (default 1000000).
+    :param symmetry_cosets: A ``SymmetryCosets`` tuple of the space group, as
+        returned by ``get_symmetry_cosets()`` (default None).
+    :return: A ``ClusterData`` tuple.
+    """
+    unique_distances: np.ndarray = find_unique_distances(
+        distance_ij=pd.Series(neighbor_list.distances)
+    )
+    site_i: np.ndarray = np.repeat(
+        np.arange(snapshot.num_sites), np.diff(neighbor_list.indptr)
+    )
+    pair_sites: np.ndarray = np.stack((site_i, neighbor_list.indices), axis=1)
+    pair_shells: np.ndarray = assign_distance_shells(
+        distances=neighbor_list.distances, unique_distances=unique_distances
+    )
+
+    pair_keys: np.ndarray = np.stack(
+        (
+            snapshot.subspecies[pair_sites[:, 0]],
+            snapshot.subspecies[pair_sites[:, 1]],
+            pair_shells,
+        ),
+        axis=1,
+    ).astype(np.int64)
+
+    if symmetry_cosets is not None:
+        pair_keys = np.concatenate(
+            (
+                pair_keys,
+                find_cluster_orbits(
+                    sites=pair_sites,
+                    edge_shells=pair_shells[:, None],
+                    symmetry_cosets=symmetry_cosets,
+                )[:, None],
+            ),
+            axis=1,
+        )
+
+    pair_clusters, pair_cluster_names = name_clusters(
+        cluster_keys=pair_keys,
+        num_site_columns=2,
+        prefix="B",
+        subspecies_names=snapshot.subspecies_names,
+    )
+
+    triplet_sites, triplet_keys, triplet_shells = find_triangles(
+        neighbor_list=neighbor_list,
+        snapshot=snapshot,
+        r=r,
+        unique_distances=unique_distances,
+        block_size=block_size,
+    )
+
+    if symmetry_cosets is not None:
+        triplet_keys = np.concatenate(
+            (
+                triplet_keys,
+                find_cluster_orbits(
+                    sites=triplet_sites,
+                    edge_shells=triplet_shells,
+                    symmetry_cosets=symmetry_cosets,
+                )[:, None],
+            ),
+            axis=1,
+        )
+
+    triplet_clusters, triplet_cluster_names = name_clusters(
+        cluster_keys=triplet_keys,
+        num_site_columns=3,
+        prefix="K",
+        subspecies_names=snapshot.subspecies_names,
+    )
+
+    return ClusterData(
+        pair_sites=pair_sites,
+        pair_clusters=pair_clusters,
+        pair_cluster_names=pair_cluster_names,
+        triplet_sites=triplet_sites,
+        triplet_clusters=triplet_clusters,
+        triplet_cluster_names=triplet_cluster_names,
+        structure=snapshot,
+    )
+
+
+def find_triangles(
+    neighbor_list: NeighborList,
+    snapshot: StructureSnapshot,
+    r: float,
+    unique_distances: np.ndarray,
+    block_size: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Enumerates the triangles of mutual neighbors. Every pair of neighbors ``j``
+    and ``k`` of a center site ``i`` is a candidate, and the candidates are kept if
+    ``j`` and ``k`` are no further apart than ``r``. Centers with the same number
+    of neighbors are processed together in vectorized blocks.
+
+    :param neighbor_list: A ``NeighborList`` tuple.
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere used to build ``neighbor_list``.
+    :param unique_distances: An array of unique neighbor distances.
+    :param block_size: The maximum number of candidate triplets handled at once.
+    :return: A tuple of three arrays. The first holds the site indices
+        ``(i, j, k)`` of each triangle, the second holds the canonical cluster key
+        of each triangle, which is the sorted subspecie codes of the three sites
+        followed by the sorted codes of the three edges, and the third holds the
+        distance shells of the edges ``ij``, ``ik``, and ``jk``.
+    """
+    num_neighbors: np.ndarray = np.diff(neighbor_list.indptr)
+    neighbor_frac_coords: np.ndarray = (
+        snapshot.frac_coords[neighbor_list.indices] + neighbor_list.images
+    )
+
+    triplet_sites: List[np.ndarray] = [np.zeros((0, 3), dtype=np.intp)]
+    triplet_keys: List[np.ndarray] = [np.zeros((0, 6), dtype=np.int64)]
+    triplet_shells: List[np.ndarray] = [np.zeros((0, 3), dtype=np.int64)]
+
+    for degree in np.unique(num_neighbors[num_neighbors > 1]):
+        centers: np.ndarray = np.flatnonzero(num_neighbors == degree)
+        neighbor_a, neighbor_b = np.triu_indices(degree, k=1)
+        centers_per_block: int = max(1, block_size // len(neighbor_a))
+
+        for block_start in range(0, len(centers), centers_per_block):
+            block_centers: np.ndarray = centers[
+                block_start:block_start + centers_per_block
+            ]
+            entry_offsets: np.ndarray = neighbor_list.indptr[block_centers, None]
+            entries_j: np.ndarray = (entry_offsets + neighbor_a).ravel()
+            entries_k: np.ndarray = (entry_offsets + neighbor_b).ravel()
+
+            distances_jk: np.ndarray = np.linalg.norm(
+                (neighbor_frac_coords[entries_k] - neighbor_frac_coords[entries_j])
+                @ snapshot.lattice,
+                axis=1,
+            )
+            is_triangle: np.ndarray = distances_jk <= r + 1e-8
+
+            entries_j = entries_j[is_triangle]
+            entries_k = entries_k[is_triangle]
+            sites: np.ndarray = np.stack(
+                (
+                    np.repeat(block_centers, len(neighbor_a))[is_triangle],
+                    neighbor_list.indices[entries_j],
+                    neighbor_list.indices[entries_k],
+                ),
+                axis=1,
+            )
+
+            edge_shells: np.ndarray = assign_distance_shells(
+                distances=np.stack(
+                    (
+                        neighbor_list.distances[entries_j],
+                        neighbor_list.distances[entries_k],
+                        distances_jk[is_triangle],
+                    ),
+                    axis=1,
+                ),
+                unique_distances=unique_distances,
+            )
+
+            triplet_sites.append(sites)
+            triplet_shells.append(edge_shells)
+            triplet_keys.append(
+                canonicalize_triangles(
+                    sites=sites,
+                    edge_shells=edge_shells,
+                    subspecies=snapshot.subspecies,
+                    num_subspecies=len(snapshot.subspecies_names),
+                )
+            )
+
+    return (
+        np.concatenate(triplet_sites),
+        np.concatenate(triplet_keys),
+        np.concatenate(triplet_shells),
+    )
+
+
+def canonicalize_triangles(
+    sites: np.ndarray,
+    edge_shells: np.ndarray,
+    subspecies: np.ndarray,
+    num_subspecies: int,
+) -> np.ndarray:
+    """Computes a canonical key for each triangle that does not depend on the order
+    of its sites. Each edge is encoded by its distance shell and the subspecie
+    codes of its two ends, and the site and edge codes are then sorted.
+
+    :param sites: An array of the site indices ``(i, j, k)`` of each triangle.
+    :param edge_shells: An array of the distance shells of the edges ``ij``,
+        ``ik``, and ``jk`` of each triangle.
+    :param subspecies: An array of the subspecie code of each site.
+    :param num_subspecies: The number of distinct subspecie labels.
+    :return: An array of the canonical key of each triangle.
+    """
+    site_subspecies: np.ndarray = subspecies[sites].astype(np.int64)
+    edge_ends: np.ndarray = np.stack(
+        (
+            site_subspecies[:, [0, 0, 1]],
+            site_subspecies[:, [1, 2, 2]],
+        ),
+        axis=2,
+    )
+
+    edge_codes: np.ndarray = (
+        edge_shells * num_subspecies + edge_ends.min(axis=2)
+    ) * num_subspecies + edge_ends.max(axis=2)
+
+    return np.concatenate(
+        (np.sort(site_subspecies, axis=1), np.sort(edge_codes, axis=1)), axis=1
+    )
+
+
+def find_cluster_orbits(
+    sites: np.ndarray, edge_shells: np.ndarray, symmetry_cosets: SymmetryCosets
+) -> np.ndarray:
+    """Labels each cluster by its orbit under the space group. A cluster is
+    described by the reference sites of its sites, the translation offsets of its
+    sites relative to its first site, and the distance shell of every edge. This
+    description does not change under a pure translation. Every coset
+    representative and every reordering of the sites is applied, and the
+    lexicographically smallest description is used as the canonical representative
+    of the orbit. Clusters that differ only in the periodic images of their sites
+    are not told apart.
+
+    :param sites: An array of shape (number of clusters, number of sites) of site
+        indices, with two or three sites per cluster.
+    :param edge_shells: An array of the distance shells of the edges of each
+        cluster, ordered as the site pairs ``(0, 1)``, ``(0, 2)``, ``(1, 2)``.
+    :param symmetry_cosets: A ``SymmetryCosets`` tuple of the space group, as
+        returned by ``get_symmetry_cosets()``.
+    :return: An integer array of the orbit index of each cluster.
+    """
+    num_cluster_sites: int = sites.shape[1]
+    orderings: List[Tuple[int, ...]] = list(
+        itertools.permutations(range(num_cluster_sites))
+    )
+    edge_orders: List[List[int]] = [
+        [
+            CLUSTER_EDGES[tuple(sorted((ordering[a], ordering[b])))]
+            for a, b in itertools.combinations(range(num_cluster_sites), 2)
+        ]
+        for ordering in orderings
+    ]
+
+    canonical_clusters: Optional[np.ndarray] = None
+
+    for permutation in symmetry_cosets.site_permutations:
+        permuted_sites: np.ndarray = permutation[sites]
+
+        for ordering, edge_order in zip(orderings, edge_orders):
+            ordered_sites: np.ndarray = permuted_sites[:, ordering]
+            relative_offsets: np.ndarray = np.mod(
+                symmetry_cosets.translation_offsets[ordered_sites[:, 1:]]
+                - symmetry_cosets.translation_offsets[ordered_sites[:, :1]],
+                symmetry_cosets.num_translations,
+            )
+            candidate_clusters: np.ndarray = np.concatenate(
+                (
+                    symmetry_cosets.reference_sites[ordered_sites],
+                    relative_offsets.reshape(len(sites), 3 * (num_cluster_sites - 1)),
+                    edge_shells[:, edge_order],
+                ),
+                axis=1,
+            ).astype(np.int64)
+            canonical_clusters = (
+                candidate_clusters
+                if canonical_clusters is None
+                else take_lexicographic_minimum(
+                    rows_a=canonical_clusters, rows_b=candidate_clusters
+                )
+            )
+
+    if canonical_clusters is None or len(canonical_clusters) == 0:
+        return np.zeros(len(sites), dtype=np.int64)
+
+    _, orbits = np.unique(canonical_clusters, axis=0, return_inverse=True)
+
+    return orbits.reshape(-1).astype(np.int64)
+
+
+def take_lexicographic_minimum(rows_a: np.ndarray, rows_b: np.ndarray) -> np.ndarray:
+    """Compares two arrays row by row and keeps the lexicographically smaller row.
+
+    :param rows_a: A two-dimensional array.
+    :param rows_b: A two-dimensional array with the same shape as ``rows_a``.
+    :return: An array of the smaller row of each pair of rows.
+    """
+    is_different: np.ndarray = rows_a != rows_b
+    first_difference: np.ndarray = np.argmax(is_different, axis=1)
+    rows: np.ndarray = np.arange(len(rows_a))
+    b_is_smaller: np.ndarray = is_different.any(axis=1) & (
+        rows_b[rows, first_difference] < rows_a[rows, first_difference]
+    )
+
+    return np.where(b_is_smaller[:, None], rows_b, rows_a)
+
+
+def assign_distance_shells(
+    distances: np.ndarray, unique_distances: np.ndarray
+) -> np.ndarray:
+    """Maps each distance to the index of the closest unique neighbor distance.
+
+    :param distances: An array of neighbor distances.
+    :param unique_distances: A sorted array of unique neighbor distances.
+    :return: An integer array of distance shell indices with the same shape as
+        ``distances``.
+    """
+    bin_edges: np.ndarray = (unique_distances[1:] + unique_distances[:-1]) / 2
+
+    return np.searchsorted(bin_edges, distances).astype(np.int64)
+
+
+def name_clusters(
+    cluster_keys: np.ndarray,
+    num_site_columns: int,
+    prefix: str,
+    subspecies_names: Tuple[str, ...],
+) -> Tuple[np.ndarray, List[str]]:
+    """Assigns a cluster index and parameter name to each distinct cluster key.
+    Clusters are ranked by distance within each combination of site subspecies,
+    and the subspecie labels are appended to the name unless all sites share the
+    same label.
+
+    :param cluster_keys: An integer array of cluster keys. The first
+        ``num_site_columns`` columns hold the subspecie codes of the sites.
+    :param num_site_columns: The number of sites in each cluster.
+    :param prefix: The prefix of the parameter names.
+    :param subspecies_names: The subspecie label of each subspecie code.
+    :return: A tuple of the cluster index of each row of ``cluster_keys`` and the
+        parameter name of each cluster.
+    """
+    unique_keys, clusters = np.unique(cluster_keys, axis=0, return_inverse=True)
+    site_keys: np.ndarray = unique_keys[:, :num_site_columns]
+
+    new_site_group: np.ndarray = np.concatenate(
+        ([True], np.any(site_keys[1:] != site_keys[:-1], axis=1))
+    )
+    group_starts: np.ndarray = np.flatnonzero(new_site_group)
+    ranks: np.ndarray = (
+        np.arange(len(unique_keys))
+        - np.repeat(group_starts, np.diff(np.append(group_starts, len(unique_keys))))
+        + 1
+    )
+
+    single_specie: bool = bool(np.all(site_keys == site_keys[:, :1]))
+    cluster_names: List[str] = []
+
+    for rank, site_codes in zip(ranks, site_keys):
+        name: str = f"{prefix}{rank}"
+
+        if not single_specie:
+            name += "_" + "".join(subspecies_names[code] for code in site_codes)
+
+        cluster_names.append(name)
+
+    return clusters.reshape(-1), cluster_names
+
+
+def build_cluster_model(
+    cluster_data: ClusterData, magnetic_patterns: MagneticPatterns
+) -> DataFrame:
+    """Builds and returns a data frame of the biquadratic and three-site interaction
+    coefficients of each magnetic pattern. The biquadratic coefficients sum
+    ``(s_i * s_j) ** 2`` over the pairs of each cluster and the three-site
+    coefficients sum ``s_i * s_j * s_k`` over the triangles of each cluster. Both
+    are normalized per site, following the convention of ``build_model()``.
+
+    :param cluster_data: A ``ClusterData`` tuple returned by ``count_clusters()``.
+    :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
+        the crystal structure. Each pattern lists the spin of every site.
+    :return: A pandas ``DataFrame`` of the interaction parameter names and
+        coefficients.
+    """
+    num_sites: int = cluster_data.structure.num_sites
+    pattern_names: List[str] = sorted(magnetic_patterns.keys())
+    spins: np.ndarray = np.array(
+        [magnetic_patterns[name] for name in pattern_names], dtype=np.float64
+    ).reshape(len(pattern_names), -1)
+
+    if spins.shape[1] != num_sites:
+        raise ValueError(
+            f"Expected spins for {num_sites} sites, got shape {spins.shape}."
+        )
+
+    pair_products: np.ndarray = np.prod(spins[:, cluster_data.pair_sites], axis=2) ** 2
+    triplet_products: np.ndarray = np.prod(spins[:, cluster_data.triplet_sites], axis=2)
+
+    df: DataFrame = DataFrame(
+        data=np.concatenate(
+            (
+                sum_within_clusters(
+                    products=pair_products,
+                    clusters=cluster_data.pair_clusters,
+                    num_clusters=len(cluster_data.pair_cluster_names),
+                )
+                / num_sites
+                / 2,
+                sum_within_clusters(
+                    products=triplet_products,
+                    clusters=cluster_data.triplet_clusters,
+                    num_clusters=len(cluster_data.triplet_cluster_names),
+                )
+                / num_sites
+                / 3,
+            ),
+            axis=1,
+        ),
+        columns=cluster_data.pair_cluster_names + cluster_data.triplet_cluster_names,
+    )
+
+    df = df.reindex(columns=sorted(df.columns))
+    df.insert(loc=0, column="pattern", value=pattern_names)
+    df.columns.name = ""
+
+    return df
+
+
+def sum_within_clusters(
+    products: np.ndarray, clusters: np.ndarray, num_clusters: int
+) -> np.ndarray:
+    """Sums spin products within each cluster.
+
+    :param products: An array of shape (number of patterns, number of clusters
+        listed) of spin products.
+    :param clusters: An array of the cluster index of each listed cluster.
+    :param num_clusters: The number of distinct clusters.
+    :return: An array of shape (number of patterns, number of distinct clusters).
+    """
+    return np.array(
+        [
+            np.bincount(clusters, weights=pattern_products, minlength=num_clusters)
+            for pattern_products in products
+        ]
+    ).reshape(len(products), num_clusters)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymatgen import Structure
+
+from neighbormodels.neighbors import (
+    IMAGE_COLUMNS,
+    NeighborData,
+    add_subspecie_labels_if_missing,
+    count_neighbors,
+    sort_neighbors_by_site_index_i,
+)
+from neighbormodels.structure import (
+    StructureSnapshot,
+    compute_minimum_image_distances,
+    to_snapshot,
+)
+
+
+def count_neighbors_batch(
+    structures: List[Structure],
+    r: float,
+    tolerance: float = 1e-3,
+    keep_vectors: bool = False,
+    split_bond_orbits: bool = False,
+) -> List[NeighborData]:
+    """Counts the neighbors of many structures, computing the neighbor data only
+    once for each set of structures that are identical up to site order, origin
+    shift, and numerical noise. Structures are first bucketed by their fingerprint
+    and then matched site by site against the structures already computed in the
+    same bucket.
+
+    :param structures: A list of pymatgen ``Structure`` objects.
+    :param r: Radius of sphere.
+    :param tolerance: The largest distance between matched sites, in the units of
+        the lattice (default 1e-3).
+    :param keep_vectors: Keep the image offset and displacement vector of every
+        neighbor pair, as in ``count_neighbors()`` (default False).
+    :param split_bond_orbits: Split neighbor shells into bond orbits, as in
+        ``count_neighbors()`` (default False).
+    :return: A list of ``NeighborData`` tuples in the order of ``structures``. The
+        site indices of each tuple refer to the sites of its own structure.
+    """
+    representatives: Dict[str, List[Tuple[StructureSnapshot, NeighborData]]] = {}
+    all_neighbor_data: List[NeighborData] = []
+
+    for cell_structure in structures:
+        cell_structure = add_subspecie_labels_if_missing(cell_structure=cell_structure)
+        snapshot: StructureSnapshot = to_snapshot(cell_structure=cell_structure)
+        fingerprint: str = fingerprint_snapshot(snapshot=snapshot, r=r)
+        neighbor_data: Optional[NeighborData] = None
+
+        for reference, reference_neighbor_data in representatives.get(fingerprint, []):
+            permutation: Optional[np.ndarray] = match_snapshots(
+                reference=reference, candidate=snapshot, tolerance=tolerance
+            )
+
+            if permutation is not None:
+                neighbor_data = remap_neighbor_data(
+                    neighbor_data=reference_neighbor_data,
+                    permutation=permutation,
+                    snapshot=snapshot,
+                )
+                break
+
+        if neighbor_data is None:
+            neighbor_data = count_neighbors(
+                cell_structure=cell_structure,
+                r=r,
+                keep_vectors=keep_vectors,
+                split_bond_orbits=split_bond_orbits,
+            )
+            representatives.setdefault(fingerprint, []).append(
+                (snapshot, neighbor_data)
+            )
+
+        all_neighbor_data.append(neighbor_data)
+
+    return all_neighbor_data
+
+
+def fingerprint_snapshot(
+    snapshot: StructureSnapshot, r: float, decimals: int = 2, block_size: int = 1000000
+) -> str:
+    """Computes a fingerprint that does not depend on site order or origin. It
+    combines the lattice lengths and angles, the composition of subspecie labels,
+    and the histogram of minimum-image neighbor distances for each pair of
+    subspecie labels. Equal fingerprints do not guarantee that structures are
+    identical, and noise that moves a value across a rounding boundary can give
+    identical structures different fingerprints.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere. Only distances up to ``r`` enter the histogram.
+    :param decimals: The number of decimals that lengths, angles, and distances
+        are rounded to (default 2).
+    :param block_size: The maximum number of distances computed at once (default
+        1000000).
+    :return: A hexadecimal digest.
+    """
+    lattice_lengths: np.ndarray = np.linalg.norm(snapshot.lattice, axis=1)
+    lattice_angles: np.ndarray = np.degrees(
+        np.arccos(
+            [
+                snapshot.lattice[b] @ snapshot.lattice[c]
+                / lattice_lengths[b]
+                / lattice_lengths[c]
+                for b, c in ((1, 2), (0, 2), (0, 1))
+            ]
+        )
+    )
+    site_labels: np.ndarray = get_site_labels(snapshot=snapshot)
+    label_names, label_codes, label_counts = np.unique(
+        site_labels, return_inverse=True, return_counts=True
+    )
+    label_codes = label_codes.reshape(-1)
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(np.round(lattice_lengths, decimals).tobytes())
+    digest.update(np.round(lattice_angles, decimals).tobytes())
+    digest.update("|".join(label_names).encode())
+    digest.update(label_counts.astype(np.int64).tobytes())
+
+    pair_keys: List[np.ndarray] = []
+    rows_per_block: int = max(1, block_size // max(1, snapshot.num_sites))
+
+    for block_start in range(0, snapshot.num_sites, rows_per_block):
+        block_stop: int = block_start + rows_per_block
+        distances: np.ndarray = compute_minimum_image_distances(
+            lattice=snapshot.lattice,
+            frac_coords_a=snapshot.frac_coords[block_start:block_stop],
+            frac_coords_b=snapshot.frac_coords,
+        )
+        rows, columns = np.nonzero((distances > 1e-8) & (distances <= r))
+
+        pair_keys.append(
+            np.stack(
+                (
+                    label_codes[block_start:block_stop][rows],
+                    label_codes[columns],
+                    np.rint(distances[rows, columns] * 10 ** decimals),
+                ),
+                axis=1,
+            ).astype(np.int64)
+        )
+
+    histogram, counts = np.unique(
+        np.concatenate(pair_keys), axis=0, return_counts=True
+    )
+    digest.update(histogram.tobytes())
+    digest.update(counts.astype(np.int64).tobytes())
+
+    return digest.hexdigest()
+
+
+def match_snapshots(
+    reference: StructureSnapshot, candidate: StructureSnapshot, tolerance: float = 1e-3
+) -> Optional[np.ndarray]:
+    """Checks whether two structures are identical up to site order and origin
+    shift. The structures must share the same lattice. Each site of the rarest
+    label in ``candidate`` is tried as the image of one fixed ``reference`` site,
+    and the resulting shift is accepted if every site then lands on a distinct site
+    with the same label.
+
+    :param reference: A ``StructureSnapshot`` tuple of the reference structure.
+    :param candidate: A ``StructureSnapshot`` tuple of the candidate structure.
+    :param tolerance: The largest distance between matched sites, in the units of
+        the lattice (default 1e-3).
+    :return: An array ``permutation`` such that site ``a`` of ``reference`` matches
+        site ``permutation[a]`` of ``candidate``, or ``None`` if the structures do
+        not match.
+    """
+    if reference.num_sites != candidate.num_sites or not np.allclose(
+        reference.lattice, candidate.lattice, atol=tolerance
+    ):
+        return None
+
+    reference_labels: np.ndarray = get_site_labels(snapshot=reference)
+    candidate_labels: np.ndarray = get_site_labels(snapshot=candidate)
+
+    label_names, label_counts = np.unique(reference_labels, return_counts=True)
+    candidate_names, candidate_counts = np.unique(candidate_labels, return_counts=True)
+
+    if not (
+        np.array_equal(label_names, candidate_names)
+        and np.array_equal(label_counts, candidate_counts)
+    ):
+        return None
+
+    rarest_label: str = label_names[np.argmin(label_counts)]
+    anchor: int = int(np.flatnonzero(reference_labels == rarest_label)[0])
+    same_label: np.ndarray = reference_labels[:, None] == candidate_labels[None, :]
+
+    for target in np.flatnonzero(candidate_labels == rarest_label):
+        shift: np.ndarray = (
+            candidate.frac_coords[target] - reference.frac_coords[anchor]
+        )
+        distances: np.ndarray = compute_minimum_image_distances(
+            lattice=reference.lattice,
+            frac_coords_a=reference.frac_coords + shift,
+            frac_coords_b=candidate.frac_coords,
+        )
+        distances[~same_label] = np.inf
+
+        permutation: np.ndarray = np.argmin(distances, axis=1)
+        matched_distances: np.ndarray = distances[
+            np.arange(reference.num_sites), permutation
+        ]
+
+        if np.all(matched_distances <= tolerance) and (
+            len(np.unique(permutation)) == reference.num_sites
+        ):
+            return permutation
+
+    return None
+
+
+def remap_neighbor_data(
+    neighbor_data: NeighborData, permutation: np.ndarray, snapshot: StructureSnapshot
+) -> NeighborData:
+    """Relabels the site indices of neighbor data computed for an identical
+    structure with a different site order and origin. The displacement vectors of
+    the bonds are unchanged by the shift, but their image offsets change for the
+    sites that were wrapped back into the unit cell.
+
+    :param neighbor_data: A ``NeighborData`` tuple of the reference structure.
+    :param permutation: An array such that site ``a`` of the reference structure is
+        site ``permutation[a]`` of the new structure.
+    :param snapshot: A ``StructureSnapshot`` tuple of the new structure.
+    :return: A ``NeighborData`` tuple for the new structure.
+    """
+    neighbor_count_df = neighbor_data.neighbor_count.assign(
+        i=lambda x: permutation[x["i"].values],
+        j=lambda x: permutation[x["j"].values],
+    ).pipe(sort_neighbors_by_site_index_i)
+
+    bonds_df = neighbor_data.bonds
+
+    if bonds_df is not None:
+        frac_offsets: np.ndarray = (
+            snapshot.frac_coords[permutation] - neighbor_data.structure.frac_coords
+        )
+        image_shifts: np.ndarray = np.rint(
+            frac_offsets[bonds_df["j"].values] - frac_offsets[bonds_df["i"].values]
+        ).astype(np.int8)
+
+        bonds_df = bonds_df.assign(
+            i=lambda x: permutation[x["i"].values].astype(np.int32),
+            j=lambda x: permutation[x["j"].values].astype(np.int32),
+            **{
+                column: bonds_df[column].values - image_shifts[:, axis]
+                for axis, column in enumerate(IMAGE_COLUMNS)
+            },
+        )
+
+    return neighbor_data._replace(
+        neighbor_count=neighbor_count_df,
+        sublattice_pairs=neighbor_data.sublattice_pairs.copy(),
+        structure=snapshot,
+        bonds=bonds_df,
+    )
+
+
+def get_site_labels(snapshot: StructureSnapshot) -> np.ndarray:
+    """Combines the species and subspecie label of each site into one string.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :return: An array of site labels.
+    """
+    return np.array(
+        [
+            f"{snapshot.species_names[specie]}:{snapshot.subspecies_names[subspecie]}"
+            for specie, subspecie in zip(snapshot.species, snapshot.subspecies)
+        ]
+    )
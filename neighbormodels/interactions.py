@@ -1,20 +1,82 @@
 # -*- coding: utf-8 -*-
 
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series
 
 from neighbormodels.neighbors import NeighborData
+from neighbormodels.structure import get_site_permutations
 
 MagneticPatterns = Dict[str, Union[int, float]]
 
 
+class ModelPlan(NamedTuple):
+    parameter_names: List[str]
+    site_i: np.ndarray
+    site_j: np.ndarray
+    weights: np.ndarray
+    group_starts: np.ndarray
+    num_sites: int
+    num_pattern_sites: int
+
+    def evaluate(self, magnetic_patterns: MagneticPatterns) -> DataFrame:
+        """Computes the model coefficients for a dictionary of magnetic patterns.
+
+        :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
+            the crystal structure. Each pattern lists the spins of the first
+            ``num_pattern_sites`` sites.
+        :return: A pandas ``DataFrame`` of the interaction parameter names and
+            coefficients, in the same format as the output of ``build_model()``.
+        """
+        pattern_names: List[str] = sorted(magnetic_patterns.keys())
+
+        coefficients: np.ndarray = self.evaluate_spins(
+            spins=np.array(
+                [magnetic_patterns[name] for name in pattern_names], dtype=np.float64
+            ).reshape(len(pattern_names), -1)
+        )
+
+        df: DataFrame = DataFrame(data=coefficients, columns=self.parameter_names)
+        df.insert(loc=0, column="pattern", value=pattern_names)
+        df.columns.name = ""
+
+        return df
+
+    def evaluate_spins(self, spins: np.ndarray) -> np.ndarray:
+        """Computes the model coefficients for an array of magnetic patterns.
+
+        :param spins: An array of shape (number of patterns, ``num_pattern_sites``)
+            with the spin of every listed site in each pattern.
+        :return: An array of shape (number of patterns, number of parameters) of the
+            model coefficients, with columns ordered as in ``parameter_names``.
+        """
+        spins = np.asarray(spins, dtype=np.float64)
+
+        if spins.ndim != 2 or spins.shape[1] != self.num_pattern_sites:
+            raise ValueError(
+                f"Expected spins for {self.num_pattern_sites} sites, got shape "
+                f"{spins.shape}. Pass num_pattern_sites to compile_model() to "
+                "evaluate patterns that list fewer sites."
+            )
+
+        if not self.parameter_names:
+            return np.zeros((spins.shape[0], 0))
+
+        pair_products: np.ndarray = (
+            spins[:, self.site_i] * spins[:, self.site_j] * self.weights
+        )
+
+        return np.add.reduceat(pair_products, self.group_starts, axis=1)
+
+
 def build_model(
     neighbor_data: NeighborData,
     magnetic_patterns: MagneticPatterns,
     distance_filter: Optional[Dict[str, List[float]]] = None,
+    deduplicate_patterns: bool = False,
+    site_permutations: Optional[np.ndarray] = None,
 ) -> DataFrame:
     """Builds and returns a data frame describing a pairwise interaction model. The
     intended use-case for the model is fitting magnetic energies taken from density
@@ -31,22 +93,47 @@ def build_model(
             intervals.
 
         ``structure``
-            A copy of the ``Structure`` object defining the crystal structure.
+            A compact ``StructureSnapshot`` of the crystal structure, which can be
+            converted back into a ``Structure`` object using ``from_snapshot()``.
     :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
         the crystal structure and used to compute the interaction coefficients of the
-        model.
+        model. All patterns list the same number of sites. If they list only the
+        first sites of the structure, pairs involving the other sites are left out
+        of the model.
     :param distance_filter: A dictionary that defines pair distances to keep in the
         model. Any pair not found int he dictionary is filtered out. The dictionary keys
         define named groups of pair distances to keep, which subsequently are used for
         naming the interaction parameters.
+    :param deduplicate_patterns: Group the magnetic patterns that are related by a
+        space group operation of the crystal structure or by a global spin flip, and
+        compute the coefficients only once for each group. Every pattern still gets
+        its own row in the output (default False).
+    :param site_permutations: The site permutations used to deduplicate the magnetic
+        patterns, as returned by ``get_site_permutations()``. Pass them when building
+        several models of the same structure, so that the symmetry search runs only
+        once (default: computed from ``neighbor_data.structure``).
     :return: A pandas ``DataFrame`` of the interaction parameter names and coefficients
         for the pairwise interaction model.
     """
+    pattern_classes: Optional[Dict[str, str]] = None
+
+    if deduplicate_patterns:
+        if site_permutations is None:
+            site_permutations = get_site_permutations(snapshot=neighbor_data.structure)
+
+        pattern_classes = group_equivalent_patterns(
+            magnetic_patterns=magnetic_patterns, site_permutations=site_permutations
+        )
+        magnetic_patterns = {
+            pattern_name: magnetic_patterns[pattern_name]
+            for pattern_name in set(pattern_classes.values())
+        }
+
     magnetic_patterns_df: DataFrame = build_magnetic_patterns_data_frame(
         magnetic_patterns=magnetic_patterns
     )
 
-    return (
+    model_df: DataFrame = (
         magnetic_patterns_df.pipe(compute_interaction_signs)
         .pipe(
             compute_model_coefficients,
@@ -56,6 +143,288 @@ def build_model(
         .pipe(spread_parameter_name_column)
     )
 
+    if pattern_classes is not None:
+        model_df = model_df.pipe(
+            expand_pattern_classes, pattern_classes=pattern_classes
+        )
+
+    return model_df
+
+
+def group_equivalent_patterns(
+    magnetic_patterns: MagneticPatterns, site_permutations: np.ndarray
+) -> Dict[str, str]:
+    """Groups magnetic patterns that are related by a site permutation or by a global
+    spin flip. Each pattern is mapped to its canonical form, which is the
+    lexicographically smallest spin array among all permuted and flipped copies of
+    the pattern.
+
+    :param magnetic_patterns: A dictionary of magnetic patterns. Each pattern lists
+        the spin of every site.
+    :param site_permutations: An array of shape (number of operations, number of
+        sites) of site permutations, as returned by ``get_site_permutations()``. If
+        the patterns list only the first sites of the structure, only the
+        permutations that map these sites onto each other are used.
+    :return: A dictionary that maps each pattern name to the name of the first
+        pattern, in sorted order, of its group.
+    """
+    pattern_names: List[str] = sorted(magnetic_patterns.keys())
+    spins: np.ndarray = np.array(
+        [magnetic_patterns[name] for name in pattern_names], dtype=np.float64
+    ).reshape(len(pattern_names), -1)
+    num_pattern_sites: int = spins.shape[1]
+
+    site_permutations = np.asarray(site_permutations)[:, :num_pattern_sites]
+    site_permutations = site_permutations[
+        np.all(site_permutations < num_pattern_sites, axis=1)
+    ]
+
+    canonical_spins: np.ndarray = spins.copy()
+
+    for permutation in site_permutations:
+        for candidate_spins in (spins[:, permutation], -spins[:, permutation]):
+            is_different: np.ndarray = candidate_spins != canonical_spins
+            first_difference: np.ndarray = np.argmax(is_different, axis=1)
+            rows: np.ndarray = np.arange(len(spins))
+            is_smaller: np.ndarray = is_different.any(axis=1) & (
+                candidate_spins[rows, first_difference]
+                < canonical_spins[rows, first_difference]
+            )
+            canonical_spins[is_smaller] = candidate_spins[is_smaller]
+
+    _, first_positions, pattern_classes = np.unique(
+        canonical_spins, axis=0, return_index=True, return_inverse=True
+    )
+
+    return {
+        pattern_name: pattern_names[first_positions[pattern_class]]
+        for pattern_name, pattern_class in zip(
+            pattern_names, pattern_classes.reshape(-1)
+        )
+    }
+
+
+def expand_pattern_classes(
+    data_frame: DataFrame, pattern_classes: Dict[str, str]
+) -> DataFrame:
+    """Copies the coefficients of each representative pattern to every pattern of its
+    group. Compatible with the pandas ``pipe()`` method.
+
+    :param data_frame: A data frame with the parameter names pivoted into their own
+        columns, with one row per representative pattern.
+    :param pattern_classes: A dictionary that maps each pattern name to the name of
+        its representative pattern.
+    :return: A data frame with one row per pattern, sorted by pattern name.
+    """
+    pattern_names: List[str] = sorted(pattern_classes.keys())
+
+    df: DataFrame = (
+        data_frame.set_index("pattern")
+        .loc[[pattern_classes[pattern_name] for pattern_name in pattern_names]]
+        .reset_index(drop=True)
+    )
+    df.insert(loc=0, column="pattern", value=pattern_names)
+    df.columns.name = ""
+
+    return df
+
+
+def sweep_distance_filters(
+    neighbor_data: NeighborData,
+    magnetic_patterns: MagneticPatterns,
+    distance_filters: Dict[str, Optional[Dict[str, List[float]]]],
+) -> Dict[str, DataFrame]:
+    """Builds the pairwise interaction model for each of several candidate distance
+    filters. The interaction coefficients of every magnetic pattern are summed within
+    each neighbor shell once, giving a matrix with one column per shell. Each
+    candidate then only labels the shells it keeps and sums the matching columns, so
+    the sweep costs about as much as a single call to ``build_model()``.
+
+    :param neighbor_data: A named tuple with three field names:
+
+        ``neighbor_count``
+            A pandas ``DataFrame`` of neighbor counts aggregated over site-index pairs
+            and separation distances.
+
+        ``sublattice_pairs``
+            A pandas ``DataFrame`` of neighbor distances mapped to unique bin
+            intervals.
+
+        ``structure``
+            A compact ``StructureSnapshot`` of the crystal structure, which can be
+            converted back into a ``Structure`` object using ``from_snapshot()``.
+    :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
+        the crystal structure and used to compute the interaction coefficients of the
+        model.
+    :param distance_filters: A dictionary of candidate distance filters keyed by a
+        name for each candidate. Each value is a distance filter as accepted by
+        ``build_model()``, or ``None`` to keep all pairs.
+    :return: A dictionary with the same keys as ``distance_filters`` and the pandas
+        ``DataFrame`` of the interaction parameter names and coefficients for each
+        candidate as values.
+    """
+    pattern_names: List[str] = sorted(magnetic_patterns.keys())
+    spins: np.ndarray = np.array(
+        [magnetic_patterns[name] for name in pattern_names], dtype=np.float64
+    ).reshape(len(pattern_names), -1)
+
+    shells_df, shell_coefficients = compute_shell_coefficients(
+        neighbor_data=neighbor_data, spins=spins
+    )
+
+    return {
+        filter_name: shells_df.pipe(
+            apply_distance_filter, distance_filter=distance_filter
+        )
+        .pipe(label_interaction_parameters)
+        .pipe(
+            sum_shell_coefficients,
+            shell_coefficients=shell_coefficients,
+            pattern_names=pattern_names,
+            num_sites=neighbor_data.structure.num_sites,
+        )
+        for filter_name, distance_filter in distance_filters.items()
+    }
+
+
+def check_distance_filter_sweep(
+    neighbor_data: NeighborData,
+    magnetic_patterns: MagneticPatterns,
+    distance_filters: Dict[str, Optional[Dict[str, List[float]]]],
+    tolerance: float = 1e-9,
+) -> None:
+    """Checks that ``sweep_distance_filters()`` gives the same model as
+    ``build_model()`` for every candidate distance filter. Use it on a small
+    structure to validate a set of candidates before a large sweep. Coefficients are
+    compared with a relative and absolute tolerance, since the two paths sum them in
+    a different order.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param magnetic_patterns: A dictionary of magnetic patterns.
+    :param distance_filters: A dictionary of candidate distance filters, as accepted
+        by ``sweep_distance_filters()``.
+    :param tolerance: The tolerance of the coefficient comparison (default 1e-9).
+    :raises ValueError: If the two paths return different models for any candidate.
+    """
+    sweep_dfs: Dict[str, DataFrame] = sweep_distance_filters(
+        neighbor_data=neighbor_data,
+        magnetic_patterns=magnetic_patterns,
+        distance_filters=distance_filters,
+    )
+
+    mismatched_filters: List[str] = []
+
+    for filter_name, distance_filter in distance_filters.items():
+        model_df: DataFrame = build_model(
+            neighbor_data=neighbor_data,
+            magnetic_patterns=magnetic_patterns,
+            distance_filter=distance_filter,
+        )
+        sweep_df: DataFrame = sweep_dfs[filter_name]
+
+        models_match: bool = (
+            list(model_df.columns) == list(sweep_df.columns)
+            and model_df["pattern"].tolist() == sweep_df["pattern"].tolist()
+            and np.allclose(
+                model_df.drop(columns="pattern").values.astype(np.float64),
+                sweep_df.drop(columns="pattern").values,
+                rtol=tolerance,
+                atol=tolerance,
+            )
+        )
+
+        if not models_match:
+            mismatched_filters.append(filter_name)
+
+    if mismatched_filters:
+        raise ValueError(
+            "The distance filter sweep differs from build_model() for the "
+            f"candidates {mismatched_filters}."
+        )
+
+
+def compile_model(
+    neighbor_data: NeighborData,
+    distance_filter: Optional[Dict[str, List[float]]] = None,
+    num_pattern_sites: Optional[int] = None,
+) -> "ModelPlan":
+    """Precomputes the structure-dependent parts of the pairwise interaction model,
+    so that the model coefficients can be evaluated quickly for many sets of
+    magnetic patterns.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param distance_filter: A dictionary that defines pair distances to keep in the
+        model. Any pair not found int he dictionary is filtered out. The dictionary keys
+        define named groups of pair distances to keep, which subsequently are used for
+        naming the interaction parameters.
+    :param num_pattern_sites: The number of sites listed in each magnetic pattern.
+        Pairs involving the other sites are left out, and the parameters are labeled
+        from the remaining pairs, as in ``build_model()`` (default: all sites).
+    :return: A ``ModelPlan`` tuple whose ``evaluate()`` method returns the same data
+        frame as ``build_model()`` for a dictionary of magnetic patterns that list
+        ``num_pattern_sites`` sites.
+    """
+    num_sites: int = neighbor_data.structure.num_sites
+    num_pattern_sites = num_sites if num_pattern_sites is None else num_pattern_sites
+
+    if not 0 < num_pattern_sites <= num_sites:
+        raise ValueError(
+            f"num_pattern_sites must be between 1 and {num_sites}, got "
+            f"{num_pattern_sites}."
+        )
+
+    neighbor_count_df: DataFrame = neighbor_data.neighbor_count
+
+    if num_pattern_sites < num_sites:
+        neighbor_count_df = neighbor_count_df[
+            (neighbor_count_df["i"] < num_pattern_sites)
+            & (neighbor_count_df["j"] < num_pattern_sites)
+        ]
+
+    pairs_df: DataFrame = (
+        neighbor_count_df.pipe(
+            group_subspecie_pairs_and_rank_by_distance,
+            sublattice_pairs=neighbor_data.sublattice_pairs,
+        )
+        .pipe(apply_distance_filter, distance_filter=distance_filter)
+        .pipe(label_interaction_parameters)
+        .sort_values(by=["parameter_name", "i", "j"], kind="mergesort")
+    )
+
+    parameter_names, group_starts = np.unique(
+        pairs_df["parameter_name"].values.astype(str), return_index=True
+    )
+
+    return ModelPlan(
+        parameter_names=[str(name) for name in parameter_names],
+        site_i=pairs_df["i"].values.astype(np.intp),
+        site_j=pairs_df["j"].values.astype(np.intp),
+        weights=pairs_df["n"].values / num_sites / 2,
+        group_starts=group_starts.astype(np.intp),
+        num_sites=num_sites,
+        num_pattern_sites=num_pattern_sites,
+    )
+
+
+def count_pattern_sites(magnetic_patterns: MagneticPatterns) -> int:
+    """Counts the sites listed in each magnetic pattern.
+
+    :param magnetic_patterns: A dictionary of magnetic patterns.
+    :return: The number of sites listed in every pattern.
+    :raises ValueError: If the patterns list different numbers of sites.
+    """
+    pattern_lengths: List[int] = sorted(
+        {len(np.atleast_1d(pattern)) for pattern in magnetic_patterns.values()}
+    )
+
+    if len(pattern_lengths) != 1:
+        raise ValueError(
+            f"Magnetic patterns must all list the same number of sites, got "
+            f"{pattern_lengths}."
+        )
+
+    return pattern_lengths[0]
+
 
 def compute_interaction_signs(magnetic_patterns_df: DataFrame) -> DataFrame:
     """Computes the signs of the pairwise interactions for the magnetic model.
@@ -95,7 +464,8 @@ def compute_model_coefficients(
             intervals.
 
         ``structure``
-            A copy of the ``Structure`` object defining the crystal structure.
+            A compact ``StructureSnapshot`` of the crystal structure, which can be
+            converted back into a ``Structure`` object using ``from_snapshot()``.
     :param distance_filter: A dictionary that defines pair distances to keep in the
         model. Any pair not found int he dictionary is filtered out. The dictionary keys
         define named groups of pair distances to keep, which subsequently are used for
@@ -120,6 +490,55 @@ def compute_model_coefficients(
     )
 
 
+def compute_shell_coefficients(
+    neighbor_data: NeighborData, spins: np.ndarray
+) -> Tuple[DataFrame, np.ndarray]:
+    """Computes the interaction coefficients of each magnetic pattern summed within
+    each neighbor shell, where a shell is a row of the sublattice pairs. The pairs
+    are sorted by shell and the products of their spins and neighbor counts are summed
+    with ``np.add.reduceat()``, as in ``ModelPlan.evaluate_spins()``.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param spins: An array of shape (number of patterns, number of pattern sites)
+        with the spin of every listed site in each pattern. Pairs involving the other
+        sites are left out.
+    :return: A tuple of a pandas ``DataFrame`` of the shells that contain pairs, with
+        a ``shell`` column giving the column of each shell, and an array of shape
+        (number of patterns, number of shells) of the summed coefficients.
+    """
+    num_pattern_sites: int = spins.shape[1]
+    neighbor_count_df: DataFrame = neighbor_data.neighbor_count
+    neighbor_count_df = neighbor_count_df[
+        (neighbor_count_df["i"] < num_pattern_sites)
+        & (neighbor_count_df["j"] < num_pattern_sites)
+    ]
+
+    pairs_df: DataFrame = neighbor_count_df.pipe(
+        group_subspecie_pairs_and_rank_by_distance,
+        sublattice_pairs=neighbor_data.sublattice_pairs.assign(
+            shell=np.arange(len(neighbor_data.sublattice_pairs))
+        ),
+    ).sort_values(by="shell", kind="mergesort")
+
+    shells, shell_starts = np.unique(pairs_df["shell"].values, return_index=True)
+    shells_df: DataFrame = (
+        neighbor_data.sublattice_pairs.iloc[shells]
+        .reset_index(drop=True)
+        .assign(shell=np.arange(len(shells)))
+    )
+
+    if len(shells) == 0:
+        return shells_df, np.zeros((spins.shape[0], 0))
+
+    site_i: np.ndarray = pairs_df["i"].values.astype(np.intp)
+    site_j: np.ndarray = pairs_df["j"].values.astype(np.intp)
+    pair_products: np.ndarray = (
+        spins[:, site_i] * spins[:, site_j] * pairs_df["n"].values
+    )
+
+    return shells_df, np.add.reduceat(pair_products, shell_starts, axis=1)
+
+
 def multiply_interaction_signs_and_neighbor_count(
     data_frame: DataFrame, interaction_signs_df: DataFrame
 ) -> DataFrame:
@@ -150,9 +569,56 @@ def group_subspecie_pairs_and_rank_by_distance(
     :param sublattice_pairs: A pandas ``DataFrame`` of unique sublattice pairs.
     :return: A copy of input ``data_frame`` with the rank column added.
     """
-    return data_frame.merge(
-        sublattice_pairs, on=["subspecies_i", "subspecies_j", "distance_bin"]
+    sublattice_columns: List[str] = ["subspecies_i", "subspecies_j", "distance_bin"]
+
+    if "bond_orbit" in sublattice_pairs.columns:
+        sublattice_columns.append("bond_orbit")
+
+    return data_frame.merge(sublattice_pairs, on=sublattice_columns)
+
+
+def sum_shell_coefficients(
+    data_frame: DataFrame,
+    shell_coefficients: np.ndarray,
+    pattern_names: List[str],
+    num_sites: int,
+) -> DataFrame:
+    """Sums the shell coefficients within each interaction parameter. Compatible with
+    the pandas ``pipe()`` method.
+
+    :param data_frame: A pandas ``DataFrame`` of labeled neighbor shells, with the
+        ``shell`` and ``parameter_name`` columns.
+    :param shell_coefficients: An array of shape (number of patterns, number of
+        shells) of the interaction coefficients summed within each shell.
+    :param pattern_names: The sorted names of the magnetic patterns.
+    :param num_sites: The total number of magnetic sites in the unit cell.
+    :return: A data frame with the parameter names pivoted into their own columns,
+        in the same format as the output of ``build_model()``.
+    """
+    df: DataFrame = data_frame.sort_values(by="parameter_name", kind="mergesort")
+
+    parameter_names, group_starts = np.unique(
+        df["parameter_name"].values.astype(str), return_index=True
+    )
+
+    coefficients: np.ndarray = np.zeros((len(pattern_names), 0))
+
+    if len(parameter_names) > 0:
+        coefficients = (
+            np.add.reduceat(
+                shell_coefficients[:, df["shell"].values], group_starts, axis=1
+            )
+            / num_sites
+            / 2
+        )
+
+    model_df: DataFrame = DataFrame(
+        data=coefficients, columns=[str(name) for name in parameter_names]
     )
+    model_df.insert(loc=0, column="pattern", value=pattern_names)
+    model_df.columns.name = ""
+
+    return model_df
 
 
 def apply_distance_filter(
@@ -204,12 +670,17 @@ def label_interaction_parameters(data_frame: DataFrame) -> DataFrame:
     of the interaction model. Compatible with the pandas ``pipe()`` method.
 
     :param data_frame: A pandas ``DataFrame`` of neighbor counts aggregated over
-        site-index pairs and separation distances ranked by subspecies pairs.
+        site-index pairs and separation distances ranked by subspecies pairs. The
+        pattern column is optional.
     :return: A copy of input ``data_frame`` with the parameter_name column added.
     """
-    df: DataFrame = data_frame.sort_values(
-        ["pattern", "filter_label", "distance_bin"]
-    ).assign(
+    sort_columns: List[str] = [
+        column
+        for column in ["pattern", "filter_label", "distance_bin"]
+        if column in data_frame.columns
+    ]
+
+    df: DataFrame = data_frame.sort_values(sort_columns).assign(
         rank=lambda x: x.groupby(["filter_label"])
         .apply(lambda y: y[["rank"]].rank(method="dense"))
         .apply(lambda y: pd.to_numeric(arg=y, downcast="integer"))
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+from concurrent.futures import Executor
 from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
@@ -8,27 +10,67 @@ from pandas import Categorical, DataFrame, IntervalIndex, Series
 from pandas.core.groupby import DataFrameGroupBy
 from pymatgen import PeriodicSite, Structure
 
-from neighbormodels.structure import label_subspecies
+from neighbormodels.partition import count_partial_neighbors
+from neighbormodels.structure import (
+    StructureSnapshot,
+    SymmetryCosets,
+    get_symmetry_cosets,
+    label_subspecies,
+    to_snapshot,
+)
 
 Neighbor = Tuple[PeriodicSite, float, int]
 SiteNeighbors = List[Optional[Neighbor]]
 AllNeighborDistances = List[SiteNeighbors]
 NeighborDistances = Dict[str, Union[List[str], List[float], List[int]]]
 
+BOND_VECTOR_COLUMNS = ["vector_x", "vector_y", "vector_z"]
+IMAGE_COLUMNS = ["image_a", "image_b", "image_c"]
+
 
 class NeighborData(NamedTuple):
     neighbor_count: DataFrame
     sublattice_pairs: DataFrame
-    structure: Structure
+    structure: StructureSnapshot
+    bonds: Optional[DataFrame] = None
+
+
+class NeighborList(NamedTuple):
+    indptr: np.ndarray
+    indices: np.ndarray
+    images: np.ndarray
+    distances: np.ndarray
 
 
-def count_neighbors(cell_structure: Structure, r: float) -> NeighborData:
+def count_neighbors(
+    cell_structure: Structure,
+    r: float,
+    executor: Optional[Executor] = None,
+    domains: Optional[Tuple[int, int, int]] = None,
+    keep_vectors: bool = False,
+    split_bond_orbits: bool = False,
+) -> NeighborData:
     """Builds a data frame containing neighbor counts grouped over site-index pairs
     and separation distances.
 
     :param cell_structure: A pymatgen ``Structure`` object.
     :param r: Radius of sphere.
-    :return: A named tuple with three field names:
+    :param executor: An executor with a ``concurrent.futures``-style ``submit()``
+        method, such as a ``ProcessPoolExecutor`` or a dask distributed ``Client``.
+        If given, the unit cell is split into spatial domains with halo regions of
+        width ``r`` and the neighbors in each domain are counted on the executor,
+        which avoids building the full table of pair distances in one process
+        (default None).
+    :param domains: The number of domains along each lattice vector when an
+        ``executor`` is given. If ``None``, the grid is chosen from ``r`` by
+        ``define_domain_grid()`` (default None).
+    :param keep_vectors: Keep the image offset and displacement vector of every
+        neighbor pair in the ``bonds`` field (default False).
+    :param split_bond_orbits: Split neighbor shells of equal distance into bond
+        orbits of the structure's space group, so that symmetry-inequivalent bonds
+        of equal length get separate interaction parameters. Sites with different
+        subspecie labels are not treated as equivalent (default False).
+    :return: A named tuple with four field names:
 
         ``neighbor_count``
             A pandas ``DataFrame`` of neighbor counts aggregated over site-index pairs
@@ -39,21 +81,57 @@ def count_neighbors(cell_structure: Structure, r: float) -> NeighborData:
             intervals.
 
         ``structure``
-            A copy of the ``Structure`` object defining the crystal structure.
+            A compact ``StructureSnapshot`` of the crystal structure, which can be
+            converted back into a ``Structure`` object using ``from_snapshot()``.
+
+        ``bonds``
+            A pandas ``DataFrame`` of the site indices, image offsets, and
+            displacement vectors of every neighbor pair if ``keep_vectors`` is set,
+            otherwise ``None``.
     """
     cell_structure = add_subspecie_labels_if_missing(cell_structure=cell_structure)
+    snapshot: StructureSnapshot = to_snapshot(cell_structure=cell_structure)
+    bonds_df: Optional[DataFrame] = None
 
-    neighbor_distances_df: DataFrame = get_neighbor_distances_data_frame(
-        cell_structure=cell_structure, r=r
-    )
+    if executor is not None and (keep_vectors or split_bond_orbits):
+        raise ValueError(
+            "keep_vectors and split_bond_orbits are not supported with an executor."
+        )
 
-    distance_bins_df: DataFrame = neighbor_distances_df.pipe(
-        define_bins_to_group_and_sort_by_distance
-    )
+    if executor is None:
+        neighbor_distances_df: DataFrame = get_neighbor_distances_data_frame(
+            cell_structure=cell_structure,
+            r=r,
+            keep_vectors=keep_vectors or split_bond_orbits,
+        )
+
+        if split_bond_orbits:
+            neighbor_distances_df = neighbor_distances_df.pipe(
+                label_bond_orbits,
+                symmetry_cosets=get_symmetry_cosets(snapshot=snapshot),
+            )
 
-    neighbor_count_df: DataFrame = neighbor_distances_df.pipe(
-        group_site_index_pairs_by_distance, distance_bins_df=distance_bins_df
-    ).pipe(count_neighbors_within_distance_groups).pipe(sort_neighbors_by_site_index_i)
+        if keep_vectors:
+            bonds_df = neighbor_distances_df.drop(
+                columns=["subspecies_i", "subspecies_j", "distance_ij"]
+            ).astype({"i": np.int32, "j": np.int32})
+
+        distance_bins_df: DataFrame = neighbor_distances_df.pipe(
+            define_bins_to_group_and_sort_by_distance
+        )
+
+        neighbor_count_df: DataFrame = neighbor_distances_df.pipe(
+            group_site_index_pairs_by_distance, distance_bins_df=distance_bins_df
+        ).pipe(count_neighbors_within_distance_groups)
+
+        del neighbor_distances_df
+
+    else:
+        neighbor_count_df = count_partial_neighbors(
+            snapshot=snapshot, r=r, executor=executor, domains=domains
+        ).pipe(reduce_partial_neighbor_counts, snapshot=snapshot)
+
+    neighbor_count_df = neighbor_count_df.pipe(sort_neighbors_by_site_index_i)
 
     sublattice_pairs_df: pd.DataFrame = neighbor_count_df.pipe(
         sort_and_rank_unique_sublattice_pairs
@@ -62,7 +140,107 @@ def count_neighbors(cell_structure: Structure, r: float) -> NeighborData:
     return NeighborData(
         neighbor_count=neighbor_count_df,
         sublattice_pairs=sublattice_pairs_df,
-        structure=cell_structure,
+        structure=snapshot,
+        bonds=bonds_df,
+    )
+
+
+def check_partitioned_neighbor_counts(
+    cell_structure: Structure,
+    r: float,
+    executor: Executor,
+    domains: Optional[Tuple[int, int, int]] = None,
+    rtol: float = 1e-9,
+) -> None:
+    """Checks that counting the neighbors on an executor gives the same neighbor
+    counts as the serial path. Use it on a small cell to validate an executor and
+    domain grid before a large run. Bin edges are compared with a relative tolerance,
+    since the two paths compute distances in a different order.
+
+    :param cell_structure: A pymatgen ``Structure`` object.
+    :param r: Radius of sphere.
+    :param executor: The executor passed to ``count_neighbors()``.
+    :param domains: The number of domains along each lattice vector. If ``None``,
+        the grid is chosen from ``r`` by ``define_domain_grid()`` (default None).
+    :param rtol: The relative tolerance of the bin edge comparison (default 1e-9).
+    :raises ValueError: If the two paths return different neighbor counts.
+    """
+    serial_df: DataFrame = count_neighbors(
+        cell_structure=cell_structure, r=r
+    ).neighbor_count
+    partitioned_df: DataFrame = count_neighbors(
+        cell_structure=cell_structure, r=r, executor=executor, domains=domains
+    ).neighbor_count
+
+    serial_bins: IntervalIndex = serial_df["distance_bin"].cat.categories
+    partitioned_bins: IntervalIndex = partitioned_df["distance_bin"].cat.categories
+
+    counts_match: bool = (
+        len(serial_bins) == len(partitioned_bins)
+        and np.allclose(serial_bins.right, partitioned_bins.right, rtol=rtol, atol=0)
+        and np.array_equal(
+            serial_df["distance_bin"].cat.codes.values,
+            partitioned_df["distance_bin"].cat.codes.values,
+        )
+        and serial_df.drop(columns="distance_bin").equals(
+            partitioned_df.drop(columns="distance_bin")
+        )
+    )
+
+    if not counts_match:
+        raise ValueError(
+            "The neighbor counts from the executor differ from the serial counts."
+        )
+
+
+def reduce_partial_neighbor_counts(
+    partial_counts_df: DataFrame, snapshot: StructureSnapshot
+) -> DataFrame:
+    """Bins the partial neighbor counts from the spatial domains by distance and sums
+    them within each group of same-distance site-index pairs. The bins are defined
+    once from the distances of all domains, and the counts are grouped by integer
+    site indices and bin codes, so no table of string labels is built before the
+    groups are summed. The subspecie labels are added at the end. The pairs of a
+    skin list are reduced the same way, each with a count of one.
+
+    :param partial_counts_df: A pandas ``DataFrame`` of neighbor counts with the
+        columns ``i``, ``j``, ``distance_ij``, and ``n``.
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :return: A pandas ``DataFrame`` of neighbor counts aggregated over site-index pairs
+        and separation distances, in the same format as the serial counting path.
+    """
+    distance_ij: np.ndarray = partial_counts_df["distance_ij"].values
+    bin_intervals: IntervalIndex = define_bins_to_group_and_sort_by_distance(
+        neighbor_distances_df=partial_counts_df
+    ).index
+    bin_codes: np.ndarray = np.searchsorted(bin_intervals.right, distance_ij)
+
+    site_i: np.ndarray = partial_counts_df["i"].values
+    site_j: np.ndarray = partial_counts_df["j"].values
+    order: np.ndarray = np.lexsort((site_j, bin_codes, site_i))
+    group_keys: np.ndarray = np.stack(
+        (site_i[order], bin_codes[order], site_j[order]), axis=1
+    )
+    group_starts: np.ndarray = np.flatnonzero(
+        np.concatenate(([True], np.any(group_keys[1:] != group_keys[:-1], axis=1)))
+    )
+    group_counts: np.ndarray = np.add.reduceat(
+        partial_counts_df["n"].values[order].astype(np.int64), group_starts
+    )
+    first_rows: np.ndarray = group_keys[group_starts]
+    subspecies_labels: np.ndarray = np.array(snapshot.subspecies_labels, dtype=object)
+
+    return DataFrame(
+        data={
+            "i": first_rows[:, 0].astype(np.int64),
+            "j": first_rows[:, 2].astype(np.int64),
+            "subspecies_i": subspecies_labels[first_rows[:, 0]],
+            "subspecies_j": subspecies_labels[first_rows[:, 2]],
+            "distance_bin": Categorical.from_codes(
+                codes=first_rows[:, 1], categories=bin_intervals, ordered=True
+            ),
+            "n": group_counts,
+        }
     )
 
 
@@ -75,6 +253,9 @@ def sort_and_rank_unique_sublattice_pairs(data_frame: DataFrame) -> DataFrame:
     subspecies_columns = ["subspecies_i", "subspecies_j"]
     sublattice_columns = subspecies_columns + ["distance_bin"]
 
+    if "bond_orbit" in data_frame.columns:
+        sublattice_columns.append("bond_orbit")
+
     return (
         data_frame.loc[:, sublattice_columns]
         .drop_duplicates(subset=sublattice_columns)
@@ -121,7 +302,7 @@ def group_site_index_pairs_by_distance(
     neighbor_distances_df: DataFrame, distance_bins_df: DataFrame
 ) -> DataFrameGroupBy:
     """Iterate over all sites, grouping by site-index pairs, subspecies pairs, and
-    bin intervals.
+    bin intervals. Bond orbits are included in the grouping if present.
 
     :param neighbor_distances_df: A pandas ``DataFrame`` containing all pairwise
         neighbor distances.
@@ -134,9 +315,18 @@ def group_site_index_pairs_by_distance(
         x=neighbor_distances_df["distance_ij"], bins=distance_bins_df.index
     ).rename("distance_bin")
 
-    return neighbor_distances_df.groupby(
-        ["i", "j", "subspecies_i", "subspecies_j", binned_distances]
-    )
+    group_keys: List[Union[str, Series]] = [
+        "i",
+        "j",
+        "subspecies_i",
+        "subspecies_j",
+        binned_distances,
+    ]
+
+    if "bond_orbit" in neighbor_distances_df.columns:
+        group_keys.append("bond_orbit")
+
+    return neighbor_distances_df.groupby(group_keys, observed=True)
 
 
 def define_bins_to_group_and_sort_by_distance(
@@ -206,12 +396,16 @@ def define_bin_intervals(unique_distances: np.ndarray) -> IntervalIndex:
     return IntervalIndex.from_breaks(breaks=bin_edges)
 
 
-def get_neighbor_distances_data_frame(cell_structure: Structure, r: float) -> DataFrame:
+def get_neighbor_distances_data_frame(
+    cell_structure: Structure, r: float, keep_vectors: bool = False
+) -> DataFrame:
     """Get data frame of pairwise neighbor distances for each atom in the unit cell,
     out to a distance ``r``.
 
     :param cell_structure: A pymatgen ``Structure`` object.
     :param r: Radius of sphere.
+    :param keep_vectors: Add ``int8`` image offset and ``float32`` displacement
+        vector columns for each pair (default False).
     :return: A pandas ``DataFrame`` of pairwise neighbor distances.
     """
     all_neighbors: AllNeighborDistances = cell_structure.get_all_neighbors(
@@ -222,7 +416,145 @@ def get_neighbor_distances_data_frame(cell_structure: Structure, r: float) -> Da
         cell_structure=cell_structure, all_neighbors=all_neighbors
     )
 
-    return DataFrame(data=neighbor_distances)
+    neighbor_distances_df: DataFrame = DataFrame(data=neighbor_distances)
+
+    if keep_vectors:
+        neighbor_frac_coords: np.ndarray = extract_neighbor_frac_coords(
+            all_neighbors=all_neighbors
+        )
+        image_offsets: np.ndarray = np.rint(
+            neighbor_frac_coords
+            - cell_structure.frac_coords[neighbor_distances_df["j"].values]
+        ).astype(np.int8)
+        bond_vectors: np.ndarray = (
+            (
+                neighbor_frac_coords
+                - cell_structure.frac_coords[neighbor_distances_df["i"].values]
+            )
+            @ cell_structure.lattice.matrix
+        ).astype(np.float32)
+
+        neighbor_distances_df = neighbor_distances_df.assign(
+            **dict(zip(IMAGE_COLUMNS, image_offsets.T)),
+            **dict(zip(BOND_VECTOR_COLUMNS, bond_vectors.T)),
+        )
+
+    return neighbor_distances_df
+
+
+def label_bond_orbits(
+    neighbor_distances_df: DataFrame,
+    symmetry_cosets: SymmetryCosets,
+    tolerance: float = 1e-3,
+) -> DataFrame:
+    """Adds a bond_orbit column that labels each pair by its bond orbit under the
+    space group. A bond is described by the reference site of the site it starts
+    from and by its displacement vector, which does not change under a pure
+    translation. Every coset representative is applied to every bond, starting from
+    either end, so that the ``i -> j`` and ``j -> i`` halves of a bond share an
+    orbit even without inversion symmetry. The lexicographically largest
+    description, with the vector rounded to ``tolerance``, is used as the canonical
+    representative of the orbit. The operations are applied one at a time, so only
+    a running maximum is stored. Compatible with the pandas ``pipe()`` method.
+
+    :param neighbor_distances_df: A pandas ``DataFrame`` of pairwise neighbor
+        distances with displacement vector columns.
+    :param symmetry_cosets: A ``SymmetryCosets`` tuple of the space group, as
+        returned by ``get_symmetry_cosets()``.
+    :param tolerance: The resolution used to match rotated vectors, in the units of
+        the vectors (default 1e-3).
+    :return: A copy of input ``neighbor_distances_df`` with the bond_orbit column
+        added.
+    """
+    vectors: np.ndarray = neighbor_distances_df[BOND_VECTOR_COLUMNS].values.astype(
+        np.float64
+    )
+    site_pairs: np.ndarray = neighbor_distances_df[["i", "j"]].values
+    canonical_bonds: Optional[np.ndarray] = None
+
+    for rotation, permutation in zip(
+        symmetry_cosets.rotations, symmetry_cosets.site_permutations
+    ):
+        rotated_vectors: np.ndarray = np.rint(vectors @ rotation.T / tolerance).astype(
+            np.int64
+        )
+
+        for end, sign in ((0, 1), (1, -1)):
+            start_sites: np.ndarray = symmetry_cosets.reference_sites[
+                permutation[site_pairs[:, end]]
+            ]
+            candidate_bonds: np.ndarray = np.concatenate(
+                (start_sites[:, None], sign * rotated_vectors), axis=1
+            )
+
+            if canonical_bonds is None:
+                canonical_bonds = candidate_bonds
+                continue
+
+            is_larger: np.ndarray = np.zeros(len(vectors), dtype=bool)
+            is_tied: np.ndarray = np.ones(len(vectors), dtype=bool)
+
+            for column in range(candidate_bonds.shape[1]):
+                is_larger |= is_tied & (
+                    candidate_bonds[:, column] > canonical_bonds[:, column]
+                )
+                is_tied &= candidate_bonds[:, column] == canonical_bonds[:, column]
+
+            canonical_bonds[is_larger] = candidate_bonds[is_larger]
+
+    _, bond_orbits = np.unique(canonical_bonds, axis=0, return_inverse=True)
+
+    return neighbor_distances_df.assign(bond_orbit=bond_orbits.reshape(-1))
+
+
+def build_neighbor_list(cell_structure: Structure, r: float) -> NeighborList:
+    """Builds an indexed neighbor list in compressed sparse row (CSR) format for each
+    atom in the unit cell, out to a distance ``r``. The neighbors of site ``i`` are
+    the entries ``indptr[i]`` through ``indptr[i + 1] - 1`` of the other arrays.
+
+    :param cell_structure: A pymatgen ``Structure`` object.
+    :param r: Radius of sphere.
+    :return: A named tuple with four field names:
+
+        ``indptr``
+            An array of the offsets of each site's neighbors.
+
+        ``indices``
+            An array of the site index of each neighbor.
+
+        ``images``
+            An ``int8`` array of the periodic image offset of each neighbor in units
+            of the lattice vectors.
+
+        ``distances``
+            An array of the distance to each neighbor.
+    """
+    all_neighbors: AllNeighborDistances = cell_structure.get_all_neighbors(
+        r=r, include_index=True
+    )
+
+    neighbor_counts: List[int] = [
+        len(site_neighbors) for site_neighbors in all_neighbors
+    ]
+    neighbors: List[Neighbor] = [
+        neighbor for site_neighbors in all_neighbors for neighbor in site_neighbors
+    ]
+
+    indices: np.ndarray = np.array(
+        [neighbor[2] for neighbor in neighbors], dtype=np.intp
+    )
+    neighbor_frac_coords: np.ndarray = np.array(
+        [neighbor[0].frac_coords for neighbor in neighbors], dtype=np.float64
+    ).reshape(-1, 3)
+
+    return NeighborList(
+        indptr=np.concatenate(([0], np.cumsum(neighbor_counts))).astype(np.intp),
+        indices=indices,
+        images=np.rint(
+            neighbor_frac_coords - cell_structure.frac_coords[indices]
+        ).astype(np.int8),
+        distances=np.array([neighbor[1] for neighbor in neighbors], dtype=np.float64),
+    )
 
 
 def extract_neighbor_distance_data(
@@ -256,6 +588,25 @@ def extract_neighbor_distance_data(
     return neighbor_distances
 
 
+def extract_neighbor_frac_coords(all_neighbors: AllNeighborDistances) -> np.ndarray:
+    """Extracts the fractional coordinates of every neighbor, in the order of the
+    rows of ``extract_neighbor_distance_data()``. The coordinates are written into a
+    preallocated array, without building a list per pair.
+
+    :param all_neighbors: A list of lists containing the neighbors for each site in
+        the structure.
+    :return: An array of shape (number of pairs, 3) of fractional coordinates.
+    """
+    neighbor_frac_coords: np.ndarray = np.empty(
+        (sum(len(site_neighbors) for site_neighbors in all_neighbors), 3)
+    )
+
+    for pair_index, site_j in enumerate(itertools.chain.from_iterable(all_neighbors)):
+        neighbor_frac_coords[pair_index] = site_j[0].frac_coords
+
+    return neighbor_frac_coords
+
+
 def append_site_i_neighbor_distance_data(
     site_i_index: int,
     site_i_neighbors: SiteNeighbors,
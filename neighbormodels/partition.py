@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+from concurrent.futures import Executor, Future
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from neighbormodels.structure import StructureSnapshot
+
+
+class DomainTask(NamedTuple):
+    lattice: np.ndarray
+    owned_indices: np.ndarray
+    owned_frac_coords: np.ndarray
+    halo_indices: np.ndarray
+    halo_frac_coords: np.ndarray
+    r: float
+
+
+def count_partial_neighbors(
+    snapshot: StructureSnapshot,
+    r: float,
+    executor: Executor,
+    domains: Optional[Tuple[int, int, int]] = None,
+) -> DataFrame:
+    """Counts the neighbors of every site by splitting the unit cell into spatial
+    domains and counting the neighbors of the sites owned by each domain on an
+    executor. Any object with a ``concurrent.futures``-style ``submit()`` method can
+    be used, for example a ``ProcessPoolExecutor`` or a dask distributed
+    ``Client``.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere.
+    :param executor: The executor that runs the domain tasks.
+    :param domains: The number of domains along each lattice vector. If ``None``,
+        the grid is chosen from ``r`` by ``define_domain_grid()`` (default None).
+    :return: A pandas ``DataFrame`` of neighbor counts aggregated over site-index
+        pairs and separation distances, with the columns ``i``, ``j``,
+        ``distance_ij``, and ``n``.
+    """
+    if domains is None:
+        domains = define_domain_grid(snapshot=snapshot, r=r)
+
+    futures: List[Future] = [
+        executor.submit(count_domain_neighbors, task)
+        for task in build_domain_tasks(snapshot=snapshot, r=r, domains=domains)
+    ]
+
+    return pd.concat([future.result() for future in futures], ignore_index=True)
+
+
+def define_domain_grid(snapshot: StructureSnapshot, r: float) -> Tuple[int, int, int]:
+    """Chooses the number of domains along each lattice vector from the radius of
+    the sphere. Every domain is at least ``4 * r`` wide, measured as the spacing of
+    the lattice planes that bound it, so the halo adds at most about 2.4 times the
+    volume of the domain while large cells are still split into many tasks.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere.
+    :return: The number of domains along each lattice vector.
+    """
+    plane_spacings: np.ndarray = 1 / np.linalg.norm(
+        np.linalg.inv(snapshot.lattice), axis=0
+    )
+    num_domains: np.ndarray = np.maximum(1, np.floor(plane_spacings / (4 * r)))
+
+    return tuple(int(n) for n in num_domains)
+
+
+def build_domain_tasks(
+    snapshot: StructureSnapshot, r: float, domains: Tuple[int, int, int]
+) -> List[DomainTask]:
+    """Splits the unit cell into a grid of domains along the lattice vectors. Each
+    task holds the sites owned by one domain and the periodic images of every site
+    within a halo of width ``r`` around the domain. The images near the unit cell are
+    found once and assigned to the range of domains whose halo contains them, so the
+    cost grows with the number of sites and not with the number of domains times the
+    number of sites.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param r: Radius of sphere.
+    :param domains: The number of domains along each lattice vector.
+    :return: A list of ``DomainTask`` tuples, skipping domains that own no sites.
+    """
+    frac_coords: np.ndarray = np.mod(snapshot.frac_coords, 1.0)
+    frac_coords[frac_coords >= 1.0] = 0.0
+    num_domains: np.ndarray = np.array(domains, dtype=np.intp)
+
+    site_domains: np.ndarray = np.minimum(
+        np.floor(frac_coords * num_domains).astype(np.intp), num_domains - 1
+    )
+    halo_widths: np.ndarray = r * np.linalg.norm(
+        np.linalg.inv(snapshot.lattice), axis=0
+    )
+
+    image_indices, image_frac_coords = find_sites_in_box(
+        frac_coords=frac_coords,
+        lower_bounds=-halo_widths,
+        upper_bounds=1 + halo_widths,
+    )
+    first_domains: np.ndarray = np.maximum(
+        np.ceil((image_frac_coords - halo_widths) * num_domains - 1 - 1e-9), 0
+    ).astype(np.intp)
+    last_domains: np.ndarray = np.minimum(
+        np.floor((image_frac_coords + halo_widths) * num_domains + 1e-9),
+        num_domains - 1,
+    ).astype(np.intp)
+    domain_spans: np.ndarray = last_domains - first_domains + 1
+
+    halo_codes: List[np.ndarray] = []
+    halo_images: List[np.ndarray] = []
+
+    for offset in itertools.product(*(range(n) for n in domain_spans.max(axis=0))):
+        in_span: np.ndarray = np.flatnonzero(np.all(domain_spans > offset, axis=1))
+        halo_codes.append(
+            np.ravel_multi_index((first_domains[in_span] + offset).T, domains)
+        )
+        halo_images.append(in_span)
+
+    halo_image_codes: np.ndarray = np.concatenate(halo_codes)
+    halo_order: np.ndarray = np.argsort(halo_image_codes, kind="stable")
+    sorted_halo_images: np.ndarray = np.concatenate(halo_images)[halo_order]
+    sorted_halo_codes: np.ndarray = halo_image_codes[halo_order]
+
+    owned_codes: np.ndarray = np.ravel_multi_index(site_domains.T, domains)
+    owned_order: np.ndarray = np.argsort(owned_codes, kind="stable")
+    sorted_owned_codes: np.ndarray = owned_codes[owned_order]
+
+    tasks: List[DomainTask] = []
+
+    for domain_code in np.unique(owned_codes):
+        owned_start, owned_stop = np.searchsorted(
+            sorted_owned_codes, [domain_code, domain_code + 1]
+        )
+        halo_start, halo_stop = np.searchsorted(
+            sorted_halo_codes, [domain_code, domain_code + 1]
+        )
+        owned_indices: np.ndarray = owned_order[owned_start:owned_stop]
+        halo_positions: np.ndarray = sorted_halo_images[halo_start:halo_stop]
+
+        tasks.append(
+            DomainTask(
+                lattice=snapshot.lattice,
+                owned_indices=owned_indices,
+                owned_frac_coords=frac_coords[owned_indices],
+                halo_indices=image_indices[halo_positions],
+                halo_frac_coords=image_frac_coords[halo_positions],
+                r=r,
+            )
+        )
+
+    return tasks
+
+
+def find_sites_in_box(
+    frac_coords: np.ndarray, lower_bounds: np.ndarray, upper_bounds: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the periodic images of every site that fall inside a box in fractional
+    coordinates.
+
+    :param frac_coords: An array of fractional coordinates wrapped into the unit
+        cell.
+    :param lower_bounds: The lower bounds of the box along each lattice vector.
+    :param upper_bounds: The upper bounds of the box along each lattice vector.
+    :return: A tuple of the site index and the unwrapped fractional coordinates of
+        each image inside the box.
+    """
+    image_ranges: List[range] = [
+        range(int(np.floor(lower)), int(np.ceil(upper)))
+        for lower, upper in zip(lower_bounds, upper_bounds)
+    ]
+    images: np.ndarray = np.array(list(itertools.product(*image_ranges)), dtype=float)
+
+    image_frac_coords: np.ndarray = frac_coords[None, :, :] + images[:, None, :]
+    in_box: np.ndarray = np.all(
+        (image_frac_coords >= lower_bounds) & (image_frac_coords <= upper_bounds),
+        axis=2,
+    )
+    site_indices: np.ndarray = np.broadcast_to(
+        np.arange(len(frac_coords)), in_box.shape
+    )
+
+    return site_indices[in_box], image_frac_coords[in_box]
+
+
+def count_domain_neighbors(task: DomainTask, block_size: int = 1000000) -> DataFrame:
+    """Counts the neighbors of the sites owned by a domain. The halo sites are sorted
+    into a grid of bins that are at least ``r`` wide, so each owned site is only
+    paired with the halo sites in its own bin and the 26 adjacent bins. Candidate
+    pairs are handled in blocks of at most ``block_size`` distances to bound memory
+    use.
+
+    :param task: A ``DomainTask`` tuple.
+    :param block_size: The maximum number of pair distances computed at once
+        (default 1000000).
+    :return: A pandas ``DataFrame`` of neighbor counts aggregated over site-index
+        pairs and separation distances, with the columns ``i``, ``j``,
+        ``distance_ij``, and ``n``.
+    """
+    owned_coords: np.ndarray = task.owned_frac_coords @ task.lattice
+    halo_coords: np.ndarray = task.halo_frac_coords @ task.lattice
+
+    bin_widths: np.ndarray = task.r * np.linalg.norm(
+        np.linalg.inv(task.lattice), axis=0
+    )
+    bin_origin: np.ndarray = task.halo_frac_coords.min(axis=0)
+    halo_bins: np.ndarray = np.floor(
+        (task.halo_frac_coords - bin_origin) / bin_widths
+    ).astype(np.intp)
+    owned_bins: np.ndarray = np.floor(
+        (task.owned_frac_coords - bin_origin) / bin_widths
+    ).astype(np.intp)
+    num_bins: np.ndarray = np.maximum(halo_bins.max(axis=0), owned_bins.max(axis=0)) + 1
+
+    halo_codes: np.ndarray = np.ravel_multi_index(halo_bins.T, num_bins)
+    halo_order: np.ndarray = np.argsort(halo_codes, kind="stable")
+    sorted_halo_codes: np.ndarray = halo_codes[halo_order]
+
+    bin_offsets: np.ndarray = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+    neighbor_bins: np.ndarray = owned_bins[:, None, :] + bin_offsets[None, :, :]
+    neighbor_codes: np.ndarray = np.ravel_multi_index(
+        np.moveaxis(neighbor_bins, 2, 0), num_bins, mode="clip"
+    )
+    bin_starts: np.ndarray = np.searchsorted(sorted_halo_codes, neighbor_codes)
+    bin_counts: np.ndarray = np.where(
+        np.all((neighbor_bins >= 0) & (neighbor_bins < num_bins), axis=2),
+        np.searchsorted(sorted_halo_codes, neighbor_codes, side="right") - bin_starts,
+        0,
+    )
+
+    candidates_per_site: np.ndarray = bin_counts.sum(axis=1)
+    site_blocks: np.ndarray = (
+        np.cumsum(candidates_per_site) - candidates_per_site
+    ) // block_size
+    block_bounds: np.ndarray = np.concatenate(
+        ([0], np.flatnonzero(np.diff(site_blocks)) + 1, [len(site_blocks)])
+    )
+
+    pair_i: List[np.ndarray] = [np.zeros(0, dtype=task.owned_indices.dtype)]
+    pair_j: List[np.ndarray] = [np.zeros(0, dtype=task.halo_indices.dtype)]
+    pair_distances: List[np.ndarray] = [np.zeros(0)]
+
+    for block_start, block_stop in zip(block_bounds[:-1], block_bounds[1:]):
+        block_counts: np.ndarray = bin_counts[block_start:block_stop].ravel()
+        block_offsets: np.ndarray = np.cumsum(block_counts) - block_counts
+        owned_positions: np.ndarray = np.repeat(
+            np.arange(block_start, block_stop),
+            candidates_per_site[block_start:block_stop],
+        )
+        halo_positions: np.ndarray = halo_order[
+            np.repeat(
+                bin_starts[block_start:block_stop].ravel() - block_offsets,
+                block_counts,
+            )
+            + np.arange(block_counts.sum())
+        ]
+        distances: np.ndarray = np.linalg.norm(
+            halo_coords[halo_positions] - owned_coords[owned_positions], axis=1
+        )
+        in_range: np.ndarray = (distances > 1e-8) & (distances <= task.r)
+
+        pair_i.append(task.owned_indices[owned_positions[in_range]])
+        pair_j.append(task.halo_indices[halo_positions[in_range]])
+        pair_distances.append(distances[in_range])
+
+    return aggregate_pair_distances(
+        i=np.concatenate(pair_i),
+        j=np.concatenate(pair_j),
+        distance_ij=np.concatenate(pair_distances),
+    )
+
+
+def aggregate_pair_distances(
+    i: np.ndarray, j: np.ndarray, distance_ij: np.ndarray
+) -> DataFrame:
+    """Counts the pairs that share site indices and a separation distance. Distances
+    are matched after rounding to 1e-6.
+
+    :param i: An array of the site index of the first site in each pair.
+    :param j: An array of the site index of the second site in each pair.
+    :param distance_ij: An array of the separation distance of each pair.
+    :return: A pandas ``DataFrame`` with the columns ``i``, ``j``, ``distance_ij``,
+        and ``n``.
+    """
+    pair_keys: np.ndarray = np.stack(
+        (i, j, np.rint(distance_ij * 1e6).astype(np.int64)), axis=1
+    )
+    _, first_positions, counts = np.unique(
+        pair_keys, axis=0, return_index=True, return_counts=True
+    )
+
+    return DataFrame(
+        data={
+            "i": i[first_positions].astype(np.int32),
+            "j": j[first_positions].astype(np.int32),
+            "distance_ij": distance_ij[first_positions],
+            "n": counts.astype(np.int32),
+        }
+    )
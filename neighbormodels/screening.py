@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from neighbormodels.interactions import ModelPlan, compile_model
+from neighbormodels.neighbors import NeighborData
+
+
+class PairEnergyModel(NamedTuple):
+    site_i: np.ndarray
+    site_j: np.ndarray
+    weights: np.ndarray
+    num_sites: int
+
+    def evaluate(
+        self, configurations: np.ndarray, block_size: int = 1000000
+    ) -> np.ndarray:
+        """Computes the energy of each configuration. The pairs are handled in
+        blocks, so that at most ``block_size`` pair products are held in memory at
+        once, whatever the number of pairs.
+
+        :param configurations: An array of shape (number of configurations, number
+            of sites) with the spin or occupation of every site.
+        :param block_size: The maximum number of pair products computed at once
+            (default 1000000).
+        :return: An array of energies, one per configuration.
+        """
+        energies: np.ndarray = np.zeros(len(configurations))
+        pairs_per_block: int = max(1, block_size // max(1, len(configurations)))
+
+        for block_start in range(0, len(self.weights), pairs_per_block):
+            block: slice = slice(block_start, block_start + pairs_per_block)
+            energies += (
+                configurations[:, self.site_i[block]]
+                * configurations[:, self.site_j[block]]
+            ) @ self.weights[block]
+
+        return energies
+
+
+class ScreeningResult(NamedTuple):
+    energies: DataFrame
+    configurations: np.ndarray
+    num_configurations: int
+
+
+def screen_configurations(
+    neighbor_data: NeighborData,
+    exchange_parameters: Dict[str, float],
+    configurations: Iterable[np.ndarray],
+    k: int = 10,
+    chunk_size: int = 4096,
+    distance_filter: Optional[Dict[str, List[float]]] = None,
+    num_pattern_sites: Optional[int] = None,
+    block_size: int = 1000000,
+) -> ScreeningResult:
+    """Finds the lowest-energy configurations of a fitted pairwise interaction model.
+    Configurations are read from an iterable and evaluated in chunks, and only the
+    ``k`` lowest energies seen so far are kept, so memory use does not grow with the
+    number of configurations. Within a chunk, the pair products are computed in
+    blocks, so memory use does not grow with the number of pairs either.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param exchange_parameters: A dictionary of fitted interaction parameters keyed
+        by the parameter names of ``build_model()``. Parameters that are missing
+        from the dictionary do not contribute to the energy.
+    :param configurations: An iterable of arrays of spins or occupations. Each array
+        is either one configuration of shape (``num_pattern_sites``,) or a stack of
+        configurations of shape (number of configurations, ``num_pattern_sites``).
+    :param k: The number of lowest-energy configurations to keep (default 10).
+    :param chunk_size: The number of configurations evaluated at once (default
+        4096).
+    :param distance_filter: A dictionary that defines pair distances to keep in the
+        model, as accepted by ``build_model()``.
+    :param num_pattern_sites: The number of sites listed in each configuration, as
+        accepted by ``compile_model()`` (default: all sites).
+    :param block_size: The maximum number of pair products computed at once
+        (default 1000000).
+    :return: A named tuple with three field names:
+
+        ``energies``
+            A pandas ``DataFrame`` with the columns ``configuration``, the position
+            of the configuration in the input stream, and ``energy``, sorted from
+            the lowest energy.
+
+        ``configurations``
+            An array of the configurations in the same order as ``energies``.
+
+        ``num_configurations``
+            The number of configurations screened.
+    """
+    if k < 1 or chunk_size < 1:
+        raise ValueError("k and chunk_size must be positive.")
+
+    energy_model: PairEnergyModel = compile_pair_energy_model(
+        neighbor_data=neighbor_data,
+        exchange_parameters=exchange_parameters,
+        distance_filter=distance_filter,
+        num_pattern_sites=num_pattern_sites,
+    )
+
+    best_energies: np.ndarray = np.zeros(0)
+    best_indices: np.ndarray = np.zeros(0, dtype=np.int64)
+    best_configurations: np.ndarray = np.zeros((0, energy_model.num_sites))
+    num_configurations: int = 0
+
+    for chunk in iterate_configuration_chunks(
+        configurations=configurations,
+        num_sites=energy_model.num_sites,
+        chunk_size=chunk_size,
+    ):
+        best_energies, best_indices, best_configurations = keep_lowest_energies(
+            energies=np.concatenate(
+                (
+                    best_energies,
+                    energy_model.evaluate(configurations=chunk, block_size=block_size),
+                )
+            ),
+            indices=np.concatenate(
+                (
+                    best_indices,
+                    np.arange(num_configurations, num_configurations + len(chunk)),
+                )
+            ),
+            configurations=np.concatenate((best_configurations, chunk)),
+            k=k,
+        )
+        num_configurations += len(chunk)
+
+    order: np.ndarray = np.lexsort((best_indices, best_energies))
+
+    return ScreeningResult(
+        energies=DataFrame(
+            data={
+                "configuration": best_indices[order],
+                "energy": best_energies[order],
+            }
+        ),
+        configurations=best_configurations[order],
+        num_configurations=num_configurations,
+    )
+
+
+def compile_pair_energy_model(
+    neighbor_data: NeighborData,
+    exchange_parameters: Dict[str, float],
+    distance_filter: Optional[Dict[str, List[float]]] = None,
+    num_pattern_sites: Optional[int] = None,
+) -> PairEnergyModel:
+    """Folds fitted interaction parameters into one weight per site-index pair. The
+    pairs ``(i, j)`` and ``(j, i)`` and pairs that appear in several neighbor shells
+    are merged, so each pair of sites is multiplied only once per configuration.
+
+    :param neighbor_data: A ``NeighborData`` tuple returned by ``count_neighbors()``.
+    :param exchange_parameters: A dictionary of fitted interaction parameters keyed
+        by the parameter names of ``build_model()``.
+    :param distance_filter: A dictionary that defines pair distances to keep in the
+        model, as accepted by ``build_model()``.
+    :param num_pattern_sites: The number of sites listed in each configuration, as
+        accepted by ``compile_model()`` (default: all sites).
+    :return: A ``PairEnergyModel`` tuple. The energies it computes are
+        ``sum(exchange_parameters[name] * coefficient[name])`` over the coefficients
+        returned by ``build_model()``.
+    """
+    plan: ModelPlan = compile_model(
+        neighbor_data=neighbor_data,
+        distance_filter=distance_filter,
+        num_pattern_sites=num_pattern_sites,
+    )
+
+    unknown_names: List[str] = sorted(
+        set(exchange_parameters.keys()) - set(plan.parameter_names)
+    )
+
+    if unknown_names:
+        raise ValueError(f"Unknown interaction parameters: {unknown_names}.")
+
+    group_sizes: np.ndarray = np.diff(
+        np.append(plan.group_starts, len(plan.weights))
+    ).astype(np.intp)
+    parameter_values: np.ndarray = np.array(
+        [exchange_parameters.get(name, 0.0) for name in plan.parameter_names],
+        dtype=np.float64,
+    )
+
+    pair_sites: np.ndarray = np.sort(np.stack((plan.site_i, plan.site_j), axis=1))
+    unique_pairs, pair_positions = np.unique(pair_sites, axis=0, return_inverse=True)
+    pair_weights: np.ndarray = np.bincount(
+        pair_positions.reshape(-1),
+        weights=plan.weights * np.repeat(parameter_values, group_sizes),
+        minlength=len(unique_pairs),
+    )
+    is_nonzero: np.ndarray = pair_weights != 0
+
+    return PairEnergyModel(
+        site_i=unique_pairs[is_nonzero, 0],
+        site_j=unique_pairs[is_nonzero, 1],
+        weights=pair_weights[is_nonzero],
+        num_sites=plan.num_pattern_sites,
+    )
+
+
+def iterate_configuration_chunks(
+    configurations: Iterable[np.ndarray], num_sites: int, chunk_size: int
+) -> Iterator[np.ndarray]:
+    """Regroups a stream of configurations into chunks of equal size. Only the last
+    chunk may be smaller.
+
+    :param configurations: An iterable of arrays of shape (number of sites,) or
+        (number of configurations, number of sites).
+    :param num_sites: The number of sites in the structure.
+    :param chunk_size: The number of configurations in each chunk.
+    :return: An iterator of arrays of shape (chunk size, number of sites).
+    """
+    buffered_rows: List[np.ndarray] = []
+    num_buffered: int = 0
+
+    for configuration in configurations:
+        rows: np.ndarray = np.asarray(configuration, dtype=np.float64)
+
+        if rows.ndim == 1:
+            rows = rows[None, :]
+
+        if rows.ndim != 2 or rows.shape[1] != num_sites:
+            raise ValueError(
+                f"Expected configurations for {num_sites} sites, got shape "
+                f"{np.shape(configuration)}."
+            )
+
+        buffered_rows.append(rows)
+        num_buffered += len(rows)
+
+        if num_buffered >= chunk_size:
+            buffer: np.ndarray = np.concatenate(buffered_rows)
+            num_full_rows: int = len(buffer) - len(buffer) % chunk_size
+
+            for chunk_start in range(0, num_full_rows, chunk_size):
+                yield buffer[chunk_start:chunk_start + chunk_size]
+
+            buffered_rows = [buffer[num_full_rows:]]
+            num_buffered = len(buffered_rows[0])
+
+    if num_buffered > 0:
+        yield np.concatenate(buffered_rows)
+
+
+def keep_lowest_energies(
+    energies: np.ndarray, indices: np.ndarray, configurations: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Selects the ``k`` lowest energies and their configurations, in no particular
+    order. Ties at the largest kept energy are broken in favor of the configurations
+    that came first in the input stream.
+
+    :param energies: An array of energies.
+    :param indices: An array of the position of each configuration in the input
+        stream.
+    :param configurations: An array of configurations, one row per energy.
+    :param k: The number of configurations to keep.
+    :return: A tuple of the selected energies, indices, and configurations.
+    """
+    if len(energies) > k:
+        kth_energy: float = np.partition(energies, k - 1)[k - 1]
+        below: np.ndarray = np.flatnonzero(energies < kth_energy)
+        tied: np.ndarray = np.flatnonzero(energies == kth_energy)
+        selected: np.ndarray = np.concatenate(
+            (below, tied[np.argsort(indices[tied], kind="stable")][: k - len(below)])
+        )
+        energies = energies[selected]
+        indices = indices[selected]
+        configurations = configurations[selected]
+
+    return energies, indices, configurations
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import itertools
 from collections import Counter
-from typing import List, NamedTuple, Tuple, Union
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 
+import numpy as np
+import spglib
 from pymatgen import Lattice, Structure
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 
 
 class StructureParameters(NamedTuple):
@@ -14,6 +18,33 @@ class StructureParameters(NamedTuple):
     coordinates: List[List[float]]
 
 
+class StructureSnapshot(NamedTuple):
+    lattice: np.ndarray
+    frac_coords: np.ndarray
+    species: np.ndarray
+    species_names: Tuple[str, ...]
+    subspecies: np.ndarray
+    subspecies_names: Tuple[str, ...]
+
+    @property
+    def num_sites(self) -> int:
+        """The number of sites in the crystal structure."""
+        return len(self.species)
+
+    @property
+    def subspecies_labels(self) -> List[str]:
+        """The subspecie label of each site in the crystal structure."""
+        return [self.subspecies_names[code] for code in self.subspecies]
+
+
+class SymmetryCosets(NamedTuple):
+    rotations: np.ndarray
+    site_permutations: np.ndarray
+    reference_sites: np.ndarray
+    translation_offsets: np.ndarray
+    num_translations: int
+
+
 def from_parameters(structure_parameters: StructureParameters) -> Structure:
     """Generates a pymatgen ``Structure`` object using a material's structural
     parameters.
@@ -51,6 +82,72 @@ def from_file(structure_file: str) -> Structure:
     return cell_structure
 
 
+def to_snapshot(cell_structure: Structure) -> StructureSnapshot:
+    """Generates a compact, array-backed snapshot of a pymatgen ``Structure`` object.
+
+    The snapshot stores the lattice matrix, the fractional coordinates, and integer
+    codes for the species and subspecie labels of each site, which makes it much
+    cheaper to pickle than the ``Structure`` object itself. Site properties other
+    than ``subspecie`` are not kept. Sites without subspecie labels are labeled with
+    their atomic species name.
+
+    :param cell_structure: A pymatgen ``Structure`` object with ordered sites.
+    :return: A ``StructureSnapshot`` tuple of the crystal structure.
+    """
+    species_names, species_codes = np.unique(
+        [str(specie) for specie in cell_structure.species], return_inverse=True
+    )
+
+    if "subspecie" in cell_structure.site_properties:
+        subspecies_labels: List[str] = cell_structure.site_properties["subspecie"]
+
+    else:
+        subspecies_labels = get_subspecies_labels(
+            cell_structure=cell_structure, site_indices=[]
+        )
+
+    subspecies_names, subspecies_codes = np.unique(
+        subspecies_labels, return_inverse=True
+    )
+
+    snapshot_arrays: List[np.ndarray] = [
+        np.array(cell_structure.lattice.matrix, dtype=np.float64),
+        np.array(cell_structure.frac_coords, dtype=np.float64),
+        species_codes.astype(np.uint16),
+        subspecies_codes.astype(np.uint16),
+    ]
+
+    for array in snapshot_arrays:
+        array.setflags(write=False)
+
+    lattice, frac_coords, species, subspecies = snapshot_arrays
+
+    return StructureSnapshot(
+        lattice=lattice,
+        frac_coords=frac_coords,
+        species=species,
+        species_names=tuple(str(name) for name in species_names),
+        subspecies=subspecies,
+        subspecies_names=tuple(str(name) for name in subspecies_names),
+    )
+
+
+def from_snapshot(snapshot: StructureSnapshot) -> Structure:
+    """Generates a pymatgen ``Structure`` object from a structure snapshot.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :return: A pymatgen ``Structure`` object with the subspecie site property set.
+    """
+    cell_structure: Structure = Structure(
+        lattice=Lattice(snapshot.lattice),
+        species=[snapshot.species_names[code] for code in snapshot.species],
+        coords=snapshot.frac_coords,
+        site_properties={"subspecie": snapshot.subspecies_labels},
+    )
+
+    return cell_structure
+
+
 def label_subspecies(
     cell_structure: Structure, site_indices: Union[List[int], int] = []
 ) -> None:
@@ -99,3 +196,420 @@ def get_subspecies_labels(
             site_properties_subspecies.append(f"{specie_name}")
 
     return site_properties_subspecies
+
+
+def get_site_permutations(
+    snapshot: StructureSnapshot, symprec: float = 0.01
+) -> np.ndarray:
+    """Gets the site permutations generated by the crystal structure's space group
+    operations. Operations that map a site onto a site with a different subspecie
+    label are skipped.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param symprec: Symmetry tolerance passed to spglib, also used as the largest
+        distance between matched sites (default 0.01).
+    :return: An array of shape (number of operations, number of sites) such that
+        each operation maps site ``a`` onto site ``permutations[operation, a]``.
+    """
+    symmetry_operations = SpacegroupAnalyzer(
+        structure=from_snapshot(snapshot=snapshot), symprec=symprec
+    ).get_symmetry_operations(cartesian=False)
+
+    site_labels: np.ndarray = np.array(snapshot.subspecies_labels)
+    permutations: List[np.ndarray] = [np.arange(snapshot.num_sites)]
+
+    for operation in symmetry_operations:
+        permutation: np.ndarray = match_periodic_sites(
+            lattice=snapshot.lattice,
+            frac_coords=snapshot.frac_coords,
+            points=operation.operate_multi(snapshot.frac_coords),
+            tolerance=symprec,
+        )
+
+        if (
+            np.all(permutation >= 0)
+            and np.array_equal(site_labels[permutation], site_labels)
+            and len(np.unique(permutation)) == snapshot.num_sites
+        ):
+            permutations.append(permutation)
+
+    return np.unique(np.array(permutations), axis=0)
+
+
+def get_symmetry_cosets(
+    snapshot: StructureSnapshot, symprec: float = 0.01
+) -> SymmetryCosets:
+    """Gets the space group operations of the crystal structure, split into its pure
+    translations and one operation per distinct rotation. Sites with different
+    subspecie labels are treated as different species.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param symprec: Symmetry tolerance passed to spglib, also used as the largest
+        distance between matched sites (default 0.01).
+    :return: A ``SymmetryCosets`` tuple, as returned by ``find_symmetry_cosets()``.
+    """
+    atom_types: np.ndarray = (
+        snapshot.species.astype(np.int64) * len(snapshot.subspecies_names)
+        + snapshot.subspecies
+    )
+    symmetry: Optional[Dict[str, np.ndarray]] = spglib.get_symmetry(
+        (snapshot.lattice, snapshot.frac_coords, atom_types + 1), symprec=symprec
+    )
+
+    if symmetry is None:
+        symmetry = {"rotations": np.eye(3)[None], "translations": np.zeros((1, 3))}
+
+    return find_symmetry_cosets(
+        snapshot=snapshot,
+        rotations=symmetry["rotations"],
+        translations=symmetry["translations"],
+        symprec=symprec,
+    )
+
+
+def find_symmetry_cosets(
+    snapshot: StructureSnapshot,
+    rotations: np.ndarray,
+    translations: np.ndarray,
+    symprec: float = 0.01,
+) -> SymmetryCosets:
+    """Splits a list of space group operations into the pure translations and one
+    operation per distinct rotation, the coset representatives. The translations
+    are not stored one by one, which would take memory proportional to the square of
+    the number of sites in a supercell. Instead, each site is assigned a reference
+    site, the lowest site index it can be translated onto, and its offset from the
+    reference site as an integer vector. Two sets of sites are then related by a
+    translation if they have the same reference sites and the same offsets relative
+    to their first site.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param rotations: An array of shape (number of operations, 3, 3) of the rotation
+        matrices of the operations in fractional coordinates.
+    :param translations: An array of shape (number of operations, 3) of the
+        translation vectors of the operations in fractional coordinates.
+    :param symprec: The largest distance between matched sites (default 0.01).
+    :return: A named tuple with five field names:
+
+        ``rotations``
+            An array of shape (number of cosets, 3, 3) of the rotation matrices of
+            the coset representatives in Cartesian coordinates.
+
+        ``site_permutations``
+            An array of shape (number of cosets, number of sites) such that each
+            coset representative maps site ``a`` onto site
+            ``site_permutations[coset, a]``.
+
+        ``reference_sites``
+            An array of the reference site of each site.
+
+        ``translation_offsets``
+            An integer array of shape (number of sites, 3) of the offset of each
+            site from its reference site, in units of ``1 / num_translations`` of
+            the lattice vectors and reduced modulo ``num_translations``.
+
+        ``num_translations``
+            The number of pure translations in the unit cell.
+    """
+    rotations = np.rint(rotations).astype(np.int64).reshape(-1, 3, 3)
+    translations = np.asarray(translations, dtype=np.float64).reshape(-1, 3)
+
+    is_translation: np.ndarray = np.all(
+        rotations == np.eye(3, dtype=np.int64), axis=(1, 2)
+    )
+    num_translations: int = max(1, int(np.count_nonzero(is_translation)))
+    translation_basis: np.ndarray = find_translation_basis(
+        translations=translations[is_translation], num_translations=num_translations
+    )
+    reference_sites, translation_offsets = find_translation_classes(
+        snapshot=snapshot,
+        translation_basis=translation_basis,
+        num_translations=num_translations,
+        symprec=symprec,
+    )
+
+    rotation_digits: np.ndarray = rotations.reshape(-1, 9) - rotations.min()
+    _, first_operations = np.unique(
+        rotation_digits @ (rotation_digits.max() + 1) ** np.arange(9),
+        return_index=True,
+    )
+    site_labels: np.ndarray = np.asarray(snapshot.subspecies)
+    inverse_lattice: np.ndarray = np.linalg.inv(snapshot.lattice)
+    coset_rotations: List[np.ndarray] = [np.eye(3)]
+    site_permutations: List[np.ndarray] = [np.arange(snapshot.num_sites)]
+
+    for operation in np.sort(first_operations):
+        if np.array_equal(rotations[operation], np.eye(3, dtype=np.int64)):
+            continue
+
+        permutation: np.ndarray = match_periodic_sites(
+            lattice=snapshot.lattice,
+            frac_coords=snapshot.frac_coords,
+            points=snapshot.frac_coords @ rotations[operation].T
+            + translations[operation],
+            tolerance=symprec,
+        )
+
+        if (
+            np.all(permutation >= 0)
+            and np.array_equal(site_labels[permutation], site_labels)
+            and len(np.unique(permutation)) == snapshot.num_sites
+        ):
+            coset_rotations.append(
+                snapshot.lattice.T @ rotations[operation] @ inverse_lattice.T
+            )
+            site_permutations.append(permutation)
+
+    return SymmetryCosets(
+        rotations=np.array(coset_rotations),
+        site_permutations=np.array(site_permutations),
+        reference_sites=reference_sites,
+        translation_offsets=translation_offsets,
+        num_translations=num_translations,
+    )
+
+
+def find_translation_basis(
+    translations: np.ndarray, num_translations: int
+) -> np.ndarray:
+    """Finds three translation vectors that generate the pure translations of a
+    space group together with the lattice vectors. The translations are scaled by
+    ``num_translations``, which makes them integer vectors, and reduced to a
+    triangular basis by integer row operations, as in the Hermite normal form.
+
+    :param translations: An array of the pure translation vectors in fractional
+        coordinates.
+    :param num_translations: The number of pure translations in the unit cell.
+    :return: An integer array of shape (3, 3) whose rows, divided by
+        ``num_translations``, are the basis vectors in fractional coordinates.
+    """
+    remaining_rows: Set[Tuple[int, ...]] = {
+        tuple(row)
+        for row in np.mod(
+            np.rint(translations * num_translations).astype(np.int64),
+            num_translations,
+        ).tolist()
+    }
+    basis_rows: List[List[int]] = []
+
+    for column in range(3):
+        pivot: List[int] = [0, 0, 0]
+        pivot[column] = num_translations
+        next_rows: Set[Tuple[int, ...]] = set()
+
+        for row in remaining_rows:
+            if row[column] != 0:
+                divisor, pivot_factor, row_factor = compute_extended_gcd(
+                    a=pivot[column], b=row[column]
+                )
+                pivot, row = (
+                    [
+                        pivot_factor * pivot_value + row_factor * row_value
+                        for pivot_value, row_value in zip(pivot, row)
+                    ],
+                    tuple(
+                        row[column] // divisor * pivot_value
+                        - pivot[column] // divisor * row_value
+                        for pivot_value, row_value in zip(pivot, row)
+                    ),
+                )
+                pivot[column + 1:] = [
+                    value % num_translations for value in pivot[column + 1:]
+                ]
+
+            row = tuple(value % num_translations for value in row)
+
+            if any(row):
+                next_rows.add(row)
+
+        basis_rows.append(pivot)
+        remaining_rows = next_rows
+
+    return np.array(basis_rows, dtype=np.int64)
+
+
+def compute_extended_gcd(a: int, b: int) -> Tuple[int, int, int]:
+    """Computes the greatest common divisor of two positive integers and the Bezout
+    coefficients ``x`` and ``y`` such that ``x * a + y * b`` equals the divisor.
+
+    :param a: A positive integer.
+    :param b: An integer.
+    :return: A tuple of the divisor, ``x``, and ``y``.
+    """
+    x, next_x, y, next_y = 1, 0, 0, 1
+
+    while b != 0:
+        quotient: int = a // b
+        a, b = b, a - quotient * b
+        x, next_x = next_x, x - quotient * next_x
+        y, next_y = next_y, y - quotient * next_y
+
+    if a < 0:
+        a, x, y = -a, -x, -y
+
+    return a, x, y
+
+
+def find_translation_classes(
+    snapshot: StructureSnapshot,
+    translation_basis: np.ndarray,
+    num_translations: int,
+    symprec: float = 0.01,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Groups the sites that are related by a pure translation. The site
+    permutations of the three basis translations are found by matching, and every
+    site is labeled with the lowest site index reachable through them. If a basis
+    translation does not map the sites onto each other, every site is its own
+    reference site.
+
+    :param snapshot: A ``StructureSnapshot`` tuple of the crystal structure.
+    :param translation_basis: An integer array of the basis translations, as
+        returned by ``find_translation_basis()``.
+    :param num_translations: The number of pure translations in the unit cell.
+    :param symprec: The largest distance between matched sites (default 0.01).
+    :return: A tuple of the reference site of each site and the offset of each site
+        from its reference site, as described in ``find_symmetry_cosets()``.
+    """
+    frac_basis: np.ndarray = translation_basis / num_translations
+    generator_permutations: List[np.ndarray] = [
+        match_periodic_sites(
+            lattice=snapshot.lattice,
+            frac_coords=snapshot.frac_coords,
+            points=snapshot.frac_coords + basis_vector,
+            tolerance=symprec,
+        )
+        for basis_vector in frac_basis
+    ]
+
+    if any(np.any(permutation < 0) for permutation in generator_permutations):
+        return (
+            np.arange(snapshot.num_sites),
+            np.zeros((snapshot.num_sites, 3), dtype=np.int64),
+        )
+
+    reference_sites: np.ndarray = np.arange(snapshot.num_sites)
+
+    while True:
+        updated_sites: np.ndarray = reference_sites
+
+        for permutation in generator_permutations:
+            updated_sites = np.minimum(updated_sites, updated_sites[permutation])
+
+        if np.array_equal(updated_sites, reference_sites):
+            break
+
+        reference_sites = updated_sites
+
+    basis_steps: np.ndarray = np.rint(
+        (snapshot.frac_coords - snapshot.frac_coords[reference_sites])
+        @ np.linalg.inv(frac_basis)
+    ).astype(np.int64)
+
+    return reference_sites, np.mod(basis_steps @ translation_basis, num_translations)
+
+
+def match_periodic_sites(
+    lattice: np.ndarray, frac_coords: np.ndarray, points: np.ndarray, tolerance: float
+) -> np.ndarray:
+    """Finds the site at each of a set of points, allowing for periodic images. The
+    sites are hashed into a grid of voxels that are at least ``tolerance`` wide, so
+    each point is only compared with the sites in its own and the neighboring
+    voxels.
+
+    :param lattice: The lattice matrix with the lattice vectors as rows.
+    :param frac_coords: An array of the fractional coordinates of the sites.
+    :param points: An array of fractional coordinates.
+    :param tolerance: The largest distance between a point and its site.
+    :return: An array of the index of the closest site to each point, or -1 where no
+        site is within ``tolerance``.
+    """
+    frac_tolerances: np.ndarray = tolerance * np.linalg.norm(
+        np.linalg.inv(lattice), axis=0
+    )
+    num_voxels: np.ndarray = np.clip(
+        np.floor(1 / frac_tolerances), 1, 2 ** 20
+    ).astype(np.int64)
+
+    site_keys: np.ndarray = encode_voxels(
+        voxels=find_voxels(frac_coords=frac_coords, num_voxels=num_voxels),
+        num_voxels=num_voxels,
+    )
+    site_order: np.ndarray = np.argsort(site_keys, kind="stable")
+    sorted_keys: np.ndarray = site_keys[site_order]
+
+    point_voxels: np.ndarray = find_voxels(frac_coords=points, num_voxels=num_voxels)
+    voxel_offsets: np.ndarray = np.unique(
+        np.array(list(itertools.product((-1, 0, 1), repeat=3))) % num_voxels, axis=0
+    )
+
+    matched_sites: np.ndarray = np.full(len(points), -1, dtype=np.intp)
+    matched_distances: np.ndarray = np.full(len(points), np.inf)
+
+    for voxel_offset in voxel_offsets:
+        keys: np.ndarray = encode_voxels(
+            voxels=(point_voxels + voxel_offset) % num_voxels, num_voxels=num_voxels
+        )
+        positions: np.ndarray = np.searchsorted(sorted_keys, keys)
+        point_indices: np.ndarray = np.arange(len(points))
+
+        while len(point_indices) > 0:
+            in_voxel: np.ndarray = positions < len(sorted_keys)
+            in_voxel[in_voxel] = sorted_keys[positions[in_voxel]] == keys[in_voxel]
+            point_indices = point_indices[in_voxel]
+            keys = keys[in_voxel]
+            positions = positions[in_voxel]
+
+            candidates: np.ndarray = site_order[positions]
+            frac_differences: np.ndarray = (
+                frac_coords[candidates] - points[point_indices]
+            )
+            frac_differences -= np.rint(frac_differences)
+            distances: np.ndarray = np.linalg.norm(frac_differences @ lattice, axis=1)
+
+            is_closer: np.ndarray = distances < matched_distances[point_indices]
+            matched_sites[point_indices[is_closer]] = candidates[is_closer]
+            matched_distances[point_indices[is_closer]] = distances[is_closer]
+            positions = positions + 1
+
+    return np.where(matched_distances <= tolerance, matched_sites, -1)
+
+
+def find_voxels(frac_coords: np.ndarray, num_voxels: np.ndarray) -> np.ndarray:
+    """Finds the voxel of each point in a grid that divides the unit cell.
+
+    :param frac_coords: An array of fractional coordinates.
+    :param num_voxels: The number of voxels along each lattice vector.
+    :return: An integer array of the voxel indices of each point.
+    """
+    return np.floor(np.mod(frac_coords, 1.0) * num_voxels).astype(np.int64) % (
+        num_voxels
+    )
+
+
+def encode_voxels(voxels: np.ndarray, num_voxels: np.ndarray) -> np.ndarray:
+    """Encodes voxel indices as a single integer per voxel.
+
+    :param voxels: An integer array of voxel indices.
+    :param num_voxels: The number of voxels along each lattice vector.
+    :return: An integer array of voxel codes.
+    """
+    return (voxels[:, 0] * num_voxels[1] + voxels[:, 1]) * num_voxels[2] + voxels[
+        :, 2
+    ]
+
+
+def compute_minimum_image_distances(
+    lattice: np.ndarray, frac_coords_a: np.ndarray, frac_coords_b: np.ndarray
+) -> np.ndarray:
+    """Computes the distances between two sets of sites using the nearest periodic
+    image along each lattice vector.
+
+    :param lattice: The lattice matrix with the lattice vectors as rows.
+    :param frac_coords_a: An array of fractional coordinates.
+    :param frac_coords_b: An array of fractional coordinates.
+    :return: An array of shape (len(frac_coords_a), len(frac_coords_b)) of
+        distances.
+    """
+    frac_differences: np.ndarray = frac_coords_b[None, :, :] - frac_coords_a[:, None, :]
+    frac_differences -= np.rint(frac_differences)
+
+    return np.linalg.norm(frac_differences @ lattice, axis=2)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from pandas import DataFrame
+from pymatgen import Structure
+
+from neighbormodels.interactions import (
+    MagneticPatterns,
+    compile_model,
+    count_pattern_sites,
+)
+from neighbormodels.neighbors import (
+    NeighborData,
+    NeighborList,
+    add_subspecie_labels_if_missing,
+    build_neighbor_list,
+    reduce_partial_neighbor_counts,
+    sort_and_rank_unique_sublattice_pairs,
+    sort_neighbors_by_site_index_i,
+)
+from neighbormodels.structure import StructureSnapshot, to_snapshot
+
+
+class SkinList(NamedTuple):
+    i: np.ndarray
+    j: np.ndarray
+    images: np.ndarray
+    reference: StructureSnapshot
+    r: float
+    skin: float
+
+
+def count_neighbors_along_trajectory(
+    frames: Iterable[Structure], r: float, skin: float = 0.5
+) -> Iterator[NeighborData]:
+    """Counts the neighbors of every frame of a relaxation or molecular dynamics
+    trajectory. A Verlet list of the pairs within ``r + skin`` is built for the first
+    frame, and later frames only update the distances of these candidate pairs. The
+    list is rebuilt once the site displacements and the strain of the lattice since
+    the list was built could bring a pair from outside ``r + skin`` to within ``r``,
+    or when the site labels change. Variable-cell trajectories therefore keep their
+    list while the cell changes slowly.
+
+    :param frames: An iterable of pymatgen ``Structure`` objects with the same sites
+        in the same order.
+    :param r: Radius of sphere.
+    :param skin: The extra search distance of the candidate pair list (default 0.5).
+    :return: An iterator of ``NeighborData`` tuples, one per frame, equal to what
+        ``count_neighbors()`` returns for that frame.
+    """
+    skin_list: Optional[SkinList] = None
+
+    for cell_structure in frames:
+        cell_structure = add_subspecie_labels_if_missing(cell_structure=cell_structure)
+        snapshot: StructureSnapshot = to_snapshot(cell_structure=cell_structure)
+
+        if skin_list is None or needs_rebuild(skin_list=skin_list, snapshot=snapshot):
+            skin_list = build_skin_list(cell_structure=cell_structure, r=r, skin=skin)
+
+        yield count_skin_list_neighbors(skin_list=skin_list, snapshot=snapshot)
+
+
+def build_models_along_trajectory(
+    frames: Iterable[Structure],
+    r: float,
+    magnetic_patterns: MagneticPatterns,
+    skin: float = 0.5,
+    distance_filter: Optional[Dict[str, List[float]]] = None,
+) -> Iterator[DataFrame]:
+    """Builds the pairwise interaction model of every frame of a trajectory, using
+    ``count_neighbors_along_trajectory()`` to count the neighbors.
+
+    :param frames: An iterable of pymatgen ``Structure`` objects with the same sites
+        in the same order.
+    :param r: Radius of sphere.
+    :param magnetic_patterns: A dictionary of magnetic patterns to be mapped onto
+        the crystal structure and used to compute the interaction coefficients of the
+        model.
+    :param skin: The extra search distance of the candidate pair list (default 0.5).
+    :param distance_filter: A dictionary that defines pair distances to keep in the
+        model, as accepted by ``build_model()``.
+    :return: An iterator of pandas ``DataFrame`` objects, one per frame, in the same
+        format as the output of ``build_model()``.
+    """
+    num_pattern_sites: int = count_pattern_sites(magnetic_patterns=magnetic_patterns)
+
+    for neighbor_data in count_neighbors_along_trajectory(
+        frames=frames, r=r, skin=skin
+    ):
+        yield compile_model(
+            neighbor_data=neighbor_data,
+            distance_filter=distance_filter,
+            num_pattern_sites=num_pattern_sites,
+        ).evaluate(magnetic_patterns=magnetic_patterns)
+
+
+def build_skin_list(cell_structure: Structure, r: float, skin: float) -> SkinList:
+    """Finds the candidate pairs of a frame, which are all pairs within ``r + skin``.
+
+    :param cell_structure: A pymatgen ``Structure`` object with subspecie labels.
+    :param r: Radius of sphere.
+    :param skin: The extra search distance.
+    :return: A ``SkinList`` tuple of the site indices and image offsets of the
+        candidate pairs, along with the frame they were found in.
+    """
+    neighbor_list: NeighborList = build_neighbor_list(
+        cell_structure=cell_structure, r=r + skin
+    )
+    neighbor_counts: np.ndarray = np.diff(neighbor_list.indptr)
+
+    return SkinList(
+        i=np.repeat(np.arange(len(neighbor_counts)), neighbor_counts),
+        j=neighbor_list.indices,
+        images=neighbor_list.images,
+        reference=to_snapshot(cell_structure=cell_structure),
+        r=r,
+        skin=skin,
+    )
+
+
+def needs_rebuild(skin_list: SkinList, snapshot: StructureSnapshot) -> bool:
+    """Checks whether the candidate pairs of a skin list may miss a neighbor pair of
+    a new frame. A pair that was longer than ``r + skin`` when the list was built is
+    at least ``s * (r + skin) - 2 * u`` long in the new frame, where ``s`` is the
+    smallest singular value of the deformation of the lattice and ``u`` is the
+    largest site displacement measured with the new lattice. The list has to be
+    rebuilt if this bound is below ``r``, or if the site labels changed.
+
+    :param skin_list: A ``SkinList`` tuple.
+    :param snapshot: A ``StructureSnapshot`` tuple of the new frame.
+    :return: ``True`` if the skin list has to be rebuilt.
+    """
+    reference: StructureSnapshot = skin_list.reference
+
+    if not (
+        reference.num_sites == snapshot.num_sites
+        and np.array_equal(reference.subspecies_labels, snapshot.subspecies_labels)
+    ):
+        return True
+
+    min_stretch: float = np.linalg.svd(
+        np.linalg.solve(reference.lattice, snapshot.lattice), compute_uv=False
+    ).min()
+    displacements: np.ndarray = np.linalg.norm(
+        get_unwrapped_frac_displacements(reference=reference, snapshot=snapshot)
+        @ snapshot.lattice,
+        axis=1,
+    )
+
+    return (
+        min_stretch * (skin_list.r + skin_list.skin)
+        - 2 * displacements.max(initial=0.0)
+        < skin_list.r
+    )
+
+
+def count_skin_list_neighbors(
+    skin_list: SkinList, snapshot: StructureSnapshot
+) -> NeighborData:
+    """Counts the neighbors of a frame by updating the distances of the candidate
+    pairs in a skin list. Every pair within ``r`` contributes one neighbor, and the
+    pairs are binned and summed on integer site indices and bin codes by
+    ``reduce_partial_neighbor_counts()``.
+
+    :param skin_list: A ``SkinList`` tuple that is valid for the frame.
+    :param snapshot: A ``StructureSnapshot`` tuple of the frame.
+    :return: A ``NeighborData`` tuple.
+    """
+    frac_coords: np.ndarray = (
+        skin_list.reference.frac_coords
+        + get_unwrapped_frac_displacements(
+            reference=skin_list.reference, snapshot=snapshot
+        )
+    )
+    distances: np.ndarray = np.linalg.norm(
+        (frac_coords[skin_list.j] + skin_list.images - frac_coords[skin_list.i])
+        @ snapshot.lattice,
+        axis=1,
+    )
+    in_range: np.ndarray = (distances > 1e-8) & (distances <= skin_list.r)
+
+    neighbor_count_df: DataFrame = (
+        DataFrame(
+            data={
+                "i": skin_list.i[in_range],
+                "j": skin_list.j[in_range],
+                "distance_ij": distances[in_range],
+                "n": np.ones(np.count_nonzero(in_range), dtype=np.int64),
+            }
+        )
+        .pipe(reduce_partial_neighbor_counts, snapshot=snapshot)
+        .pipe(sort_neighbors_by_site_index_i)
+    )
+
+    return NeighborData(
+        neighbor_count=neighbor_count_df,
+        sublattice_pairs=neighbor_count_df.pipe(sort_and_rank_unique_sublattice_pairs),
+        structure=snapshot,
+    )
+
+
+def get_unwrapped_frac_displacements(
+    reference: StructureSnapshot, snapshot: StructureSnapshot
+) -> np.ndarray:
+    """Computes the displacement of every site since the reference frame in
+    fractional coordinates, undoing any wrapping of sites back into the unit cell.
+
+    :param reference: A ``StructureSnapshot`` tuple of the reference frame.
+    :param snapshot: A ``StructureSnapshot`` tuple of the new frame.
+    :return: An array of fractional displacements.
+    """
+    frac_displacements: np.ndarray = snapshot.frac_coords - reference.frac_coords
+
+    return frac_displacements - np.rint(frac_displacements)
@@ -36,13 +36,22 @@ setuptools.setup(
         "numpy",
         "pandas",
         "pymatgen",
+        "spglib",
     ],
     extras_require={
+        "parquet": [
+            "pyarrow",
+        ],
         "docs": [
             "sphinx",
             "sphinx_rtd_theme",
         ],
     },
+    entry_points={
+        "console_scripts": [
+            "neighbormodels = neighbormodels.cli:main",
+        ],
+    },
     cmdclass={"build_sphinx": BuildDoc},
     command_options={
         "build_sphinx": {